@@ -12,6 +12,7 @@ parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
 sys.path.insert(0, parent_dir_path)
 import resources_rc  # 不导包的话程序无法使用图片资源, 而且不会报错
 import chess_play.core as core
+from chess_play.rules import Rules
 from constants import *
 from threading import Thread
 import socket
@@ -20,18 +21,23 @@ import socket
 class Opponent(QtCore.QObject):
 
     play_signal = QtCore.pyqtSignal(int, int, int, int)  # 发送
-    process_signal = QtCore.pyqtSignal(list)
+    process_signal = QtCore.pyqtSignal(list, int, list)
 
     def __init__(self, slot, parent=None) -> None:
         super(Opponent, self).__init__(parent)
-        self.AI = core.NegamaxEngine(1)
+        self.AI = core.AlphaBetaEngine(8, keep_hash=True)  # 最多8层, 对局中每一步之间保留置换表
+        self.time_ms = 2000  # 每步的思考时间
         self.process_signal.connect(self.play)
         self.play_signal.connect(slot)
 
-    @QtCore.pyqtSlot(list)  # 槽定义在哪里就是哪个线程执行
-    def play(self, chess):
-        # 下棋
-        old_point_i, old_point_j, point_i, point_j = self.AI.search_a_good_move(chess)
+    @QtCore.pyqtSlot(list, int, list)  # 槽定义在哪里就是哪个线程执行
+    def play(self, chess, side, history):
+        # 下棋, 收发的棋盘和坐标都是红子在下方的引擎坐标. 传入开局的棋盘和之后走过的棋,
+        # 引擎重走一遍, 这样才能判断重复局面和自然限着
+        move = self.AI.search_a_good_move(chess, side, time_ms=self.time_ms, history=history)
+        if move is None:  # 无棋可走, 界面走完上一步时已经判定了胜负
+            return
+        old_point_i, old_point_j, point_i, point_j = move
         # 发送给主线程
         self.play_signal.emit(old_point_i, old_point_j, point_i, point_j)
 
@@ -39,8 +45,9 @@ class Opponent(QtCore.QObject):
 class NetOpponent(QtCore.QObject):
     recv_signal = QtCore.pyqtSignal(int, int, int, int)  # 接收主线程的数据
     send_signal = QtCore.pyqtSignal(int, int, int, int)  # 发送给主线程
+    reject_signal = QtCore.pyqtSignal()  # 服务端拒绝了自己的走法
 
-    def __init__(self, slot, parent=None):
+    def __init__(self, slot, reject_slot, parent=None):
         super(NetOpponent, self).__init__(parent)
         self.data = {
             'target': 4,
@@ -56,26 +63,15 @@ class NetOpponent(QtCore.QObject):
         # 连接信号与槽
         self.send_signal.connect(self.send)
         self.recv_signal.connect(slot)
+        self.reject_signal.connect(reject_slot)
         # 开启一个线程接收远程服务端的数据
         t = Thread(target=self.recv)
         t.setDaemon(True)
         t.start()
 
-    def reverse(self, i, j):
-        '''
-        坐标翻转一下
-        :param i:
-        :param j:
-        :return:
-        '''
-        new_i, j = 9 - i, j
-        return new_i, j
-
     @QtCore.pyqtSlot(int, int, int, int)
     def send(self, old_point_i, old_point_j, point_i, point_j):
-        # 翻转一下发送
-        old_point_i, old_point_j = self.reverse(old_point_i, old_point_j)
-        point_i, point_j = self.reverse(point_i, point_j)
+        # 网络上传输的是红子在下方的引擎坐标, 双方各自在界面上转换成自己的显示方向
         self.data['old_point_i'] = old_point_i
         self.data['old_point_j'] = old_point_j
         self.data['point_i'] = point_i
@@ -87,6 +83,10 @@ class NetOpponent(QtCore.QObject):
         while True:
             data = self.client.recv(1024).decode('utf-8')
             obj = json.loads(json.loads(data))
+            if obj.get('reject'):  # 服务端认为自己刚走的这步不合法, 没有转发给对方
+                print('走法被服务端拒绝')
+                self.reject_signal.emit()
+                continue
             old_i, old_j, i, j = obj['old_point_i'], obj['old_point_j'], obj['point_i'], obj['point_j']
             print("({}, {}) -> ({}, {})".format(old_i, old_j, i, j))
             # 将数据发送给主线程
@@ -122,51 +122,30 @@ class MainWindow(QWidget):
         self.chess_background = QPixmap(':/resources/chess_board.png')
         self.click_state = 0  # 鼠标点击状态, 一共有三种, 0: 未选中, 1: 选中, 2: 移动
         self.old_point = None  # 要移动的棋子位置
+        self.last_move = None  # 最近一步棋和走之前的状态, 被服务端拒绝时用来悔棋
         self.game_state = GameState.RED
         self.whole_pixmap = QPixmap(640, 720)  # 整个棋盘的状态都会绘制到这里, 然后再统一绘制到QWidget上面
         self.win_pixmap = QPixmap(':/resources/win.png')
         self.loss_pixmap = QPixmap(':/resources/loss.png')
         self.mask_pixmap = QPixmap(':/resources/mask.png')
-        self.up_red = True  # 红子是否在上方, 代表对方先手, 需要判断一下
-        if self.up_red:
-            # 红子在上的棋盘
-            self.chess = [
-                [9, 10, 13, 12, 8, 12, 13, 10, 9],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [0, 11, 0, 0, 0, 0, 0, 11, 0],
-                [14, 0, 14, 0, 14, 0, 14, 0, 14],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [7, 0, 7, 0, 7, 0, 7, 0, 7],
-                [0, 4, 0, 0, 0, 0, 0, 4, 0],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [2, 3, 6, 5, 1, 5, 6, 3, 2]
-            ]
-            self.game_self = GameState.BLACK  # 自己是红子还是黑子
-        else:
-            # 红子在下的棋盘
-            self.chess = [
-                [2, 3, 6, 5, 1, 5, 6, 3, 2],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [0, 4, 0, 0, 0, 0, 0, 4, 0],
-                [7, 0, 7, 0, 7, 0, 7, 0, 7],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [14, 0, 14, 0, 14, 0, 14, 0, 14],
-                [0, 11, 0, 0, 0, 0, 0, 11, 0],
-                [0, 0, 0, 0, 0, 0, 0, 0, 0],
-                [9, 10, 13, 12, 8, 12, 13, 10, 9]
-            ]
-            self.game_self =GameState.BLACK if self.up_red else GameState.RED
+        self.up_red = True  # 界面上红子是否在上方, 代表对方先手. 只影响显示, 引擎和网络都使用红子在下方的坐标
+        chess = core.board_to_list(core.board_from_fen(core.START_FEN)[0])
+        self.chess = core.flip_chess(chess) if self.up_red else chess
+        self.start_chess = [row[:] for row in chess]  # 开局的棋盘, 引擎坐标
+        self.history = []  # 开局以来走过的棋, 每一步是引擎坐标的[old_i, old_j, i, j]
+        self.game_self = GameState.BLACK if self.up_red else GameState.RED  # 自己是红子还是黑子
+        self.rules = Rules(self.up_red)  # 走棋规则, 每回合缓存一次合法走法
         self.mode = 'NET'   # NET, AI
         # 定义对方线程, 开始给对方发送数据
         thread = QtCore.QThread(self)
         thread.start()  # thread线程里面有一个事件循环
         if self.mode == 'AI':
-            self.opponent = Opponent(self.move)
+            self.opponent = Opponent(self.opponent_move)
         else:
-            self.opponent = NetOpponent(self.move)
+            self.opponent = NetOpponent(self.opponent_move, self.take_back)
         self.opponent.moveToThread(thread)
+        if self.mode == 'AI' and self.game_state != self.game_self:  # AI先手
+            self.opponent_play()
 
     def init_ui(self):
         self.setFixedSize(Constants.CHESS_WIDTH, Constants.CHESS_HEIGHT)  # 设置窗口固定值(w, h)
@@ -276,181 +255,73 @@ class MainWindow(QWidget):
             self.move(old_i, old_j, idx_i, idx_j)
             self.click_state = ClickState.NO_SELECTED
             self.repaint()
-            # 对手下棋
-            self.opponent_play(old_i, old_j, idx_i, idx_j)
-            self.repaint()
+            # 对手下棋, 已经分出胜负就不用再让对手走了
+            if self.game_state not in (GameState.RED_WIN, GameState.BLACK_WIN):
+                self.opponent_play()
+                self.repaint()
         self.repaint()  # 重绘
 
-    def opponent_play(self, old_point_i, old_point_j, point_i, point_j):
-        # AI下棋
-        if self.mode == 'AI':  # AI下棋
-            self.opponent.process_signal.emit(self.chess)
-        else:  # 网络对手下棋
-            self.opponent.send_signal.emit(old_point_i, old_point_j, point_i, point_j)
+    def opponent_play(self):
+        # 发给对手的棋盘和坐标都是红子在下方的引擎坐标
+        if self.mode == 'AI':  # AI下棋, 红方先走
+            self.opponent.process_signal.emit(self.start_chess, 1, self.history[:])
+        else:  # 网络对手下棋, 只发送刚走的一步
+            self.opponent.send_signal.emit(*self.history[-1])
+
+    @QtCore.pyqtSlot(int, int, int, int)
+    def opponent_move(self, old_i, old_j, idx_i, idx_j):
+        '''
+        对手走棋, 收到的是引擎坐标, 转换成界面坐标再走
+        :return:
+        '''
+        self.move(*self.convert(old_i, old_j), *self.convert(idx_i, idx_j))
+
+    @QtCore.pyqtSlot()
+    def take_back(self):
+        '''
+        悔掉最近一步棋, 服务端拒绝了自己的走法时使用
+        :return:
+        '''
+        if self.last_move is None:
+            return
+        old_i, old_j, idx_i, idx_j, chess_man, c, game_state = self.last_move
+        self.chess[old_i][old_j] = chess_man
+        self.chess[idx_i][idx_j] = c
+        self.game_state = game_state
+        self.last_move = None
+        self.history.pop()
+        self.rules.invalidate()
+        self.repaint()
+
+    def convert(self, i, j):
+        '''
+        界面坐标与红子在下方的引擎坐标互相转换, 翻转两次得到原来的坐标, 所以两个方向用同一个函数
+        :param i: 行
+        :param j: 列
+        :return:
+        '''
+        return core.flip_point(i, j) if self.up_red else (i, j)
 
     def check(self, idx_i, idx_j):
         '''
-        判断目标位置是否合法
+        判断目标位置是否合法, 直接查规则服务缓存的本回合合法走法
         :param idx_i: 目标位置的row
         :param idx_j: 目标位置的col
         :return:
         '''
         old_idx_i, old_idx_j = self.old_point
-        old_c, c = self.chess[old_idx_i][old_idx_j], self.chess[idx_i][idx_j]
-        # 1. 如果目标位置是己方棋子则无效
-        if self.same(old_c, c):
-            print('目标位置是己方棋子, 下棋无效')
-            return False
-        # 2. 是否是己方落子
-        if self.game_state == GameState.RED and 1 <= old_c <= 7:
-            print('轮到红方落子')
-            return False
-        if self.game_state == GameState.BLACK and 8 <= old_c <= 14:
-            print('轮到黑方落子')
+        if not self.rules.is_legal(self.chess, self.side(), old_idx_i, old_idx_j, idx_i, idx_j):
+            print('走法不合法')
             return False
-        # 3. 判断棋子的走法是否符合规则
-        width, height = abs(idx_j - old_idx_j), abs(idx_i - old_idx_i)
-        if old_c == Chessman.B_KING or old_c == Chessman.R_KING:  # 帅
-            # 是否是一条直线杀对方的将军
-            if width == 0 and height > 2:
-                for i in range(min(idx_i, old_idx_i)+1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        return False
-                return old_c + c == 9  # 目的地是对方将领
-            # 只能移动一个位置, 上下左右
-            if width + height != 1:
-                return False
-            # 不能出大帐
-            if idx_j < 3 or idx_j > 5:
-                return False
-            if old_c == Chessman.B_KING:
-                if self.up_red:
-                    if idx_i < 7:
-                        return False
-                else:
-                    if idx_i > 2:
-                        return False
-            else:
-                if self.up_red:
-                    if idx_i > 2:
-                        return False
-                else:
-                    if idx_i < 7:
-                        return False
-        elif old_c == Chessman.B_CAR or old_c == Chessman.R_CAR:  # 车
-            # 车不能拐弯
-            if width > 0 and height > 0:
-                return False
-            # 中间不能有其他棋子
-            if width > 0:  # 横着走
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if self.chess[idx_i][i] != Chessman.NOCHESS:
-                        return False
-            else:  # 竖着走
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        return False
-            return True  # 不能拐弯
-        elif old_c == Chessman.B_HORSE or old_c == Chessman.R_HORSE:  # 马
-            if width == 2 and height == 1:
-                mid = (old_idx_j + idx_j) // 2
-                if self.chess[old_idx_i][mid] != Chessman.NOCHESS:
-                    return False
-            elif width == 1 and height == 2:
-                mid = (old_idx_i + idx_i) // 2
-                if self.chess[mid][old_idx_j] != Chessman.NOCHESS:
-                    return False
-            else:
-                return False
-        elif old_c == Chessman.B_CANNON or old_c == Chessman.R_CANNON:  # 炮
-            # 炮也不能拐弯
-            if width > 0 and height > 0:
-                return False
-            # 炮要吃子的话, 必须中间有炮架
-            if width > 0:  # 横着走
-                cnt = 0  # 计算中间有多少个棋子
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if self.chess[idx_i][i] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS :
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
-            else:  # 竖着走
-                cnt = 0
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS:
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
-        elif old_c == Chessman.B_BISHOP or old_c == Chessman.R_BISHOP:  # 仕
-            # 只能走斜线
-            if not (width == 1 and height == 1):
-                return False
-            # 跟将军一样只能在九宫格内
-            if idx_j < 3 or idx_j > 5:
-                return False
-            if old_c == Chessman.B_BISHOP:  # 黑仕
-                if self.up_red:
-                    if idx_i < 7:
-                        return False
-                else:
-                    if idx_i > 2:
-                        return False
-            else:  # 红仕
-                if self.up_red:
-                    if idx_i > 2:
-                        return False
-                else:
-                    if idx_i < 7:
-                        return False
-        elif old_c == Chessman.B_ELEPHANT or old_c == Chessman.R_ELEPHANT:  # 相
-            if not (width == 2 and height == 2):
-                return False
-            mid_i, mid_j = (idx_i + old_idx_i) // 2, (idx_j + old_idx_j) // 2
-            if self.chess[mid_i][mid_j] != Chessman.NOCHESS:
-                return False
-            return True
-        elif old_c == Chessman.B_PAWN or old_c == Chessman.R_PAWN:  # 兵
-            # 兵只能走一步
-            if width + height != 1:
-                return False
-            if old_c == Chessman.B_PAWN:  # 黑兵
-                if self.up_red:
-                    if idx_i > old_idx_i:
-                        return False
-                    # 没过界只能往前
-                    if old_idx_i >= 5:
-                        if width != 0:
-                            return False
-                else:
-                    if idx_i < old_idx_i:
-                        return False
-                    if old_idx_i <= 4:
-                        if width != 0:
-                            return False
-            else:  # 红兵
-                if self.up_red:
-                    if idx_i < old_idx_i:
-                        return False
-                    if old_idx_i <= 4:
-                        if width != 0:
-                            return False
-                else:
-                    if idx_i > old_idx_i:
-                        return False
-                    # 没过界只能往前
-                    if old_idx_i >= 5:
-                        if width != 0:
-                            return False
-            return True
         return True
 
-    @QtCore.pyqtSlot(int, int, int, int)
+    def side(self):
+        '''
+        轮到走棋的一方, 1为红方, 0为黑方
+        :return:
+        '''
+        return 1 if self.game_state == GameState.RED else 0
+
     def move(self, old_i, old_j, idx_i, idx_j):
         '''
         走棋, 并且在这里面判断棋子的走法是否符合规则
@@ -460,15 +331,11 @@ class MainWindow(QWidget):
         '''
         # print('收到对手的棋子.....')
         chess_man = self.chess[old_i][old_j]
-        self.chess[old_i][old_j] = 0
         c = self.chess[idx_i][idx_j]
-        if c == Chessman.B_KING:
-            print('黑将死亡')
-            self.game_state = GameState.RED_WIN
-        elif c == Chessman.R_KING:
-            print('红将死亡')
-            self.game_state = GameState.BLACK_WIN
+        self.last_move = (old_i, old_j, idx_i, idx_j, chess_man, c, self.game_state)
+        self.chess[old_i][old_j] = 0
         self.chess[idx_i][idx_j] = chess_man
+        self.history.append([*self.convert(old_i, old_j), *self.convert(idx_i, idx_j)])
         # 开始刷新
         print('开始刷新')
         self.repaint()
@@ -477,16 +344,10 @@ class MainWindow(QWidget):
             self.game_state = GameState.RED
         elif self.game_state == GameState.RED:
             self.game_state = GameState.BLACK
-
-    def same(self, chess1, chess2):
-        '''
-        判断两个棋子是否同色
-        :param chess1:
-        :param chess2:
-        :return:
-        '''
-        return (1 <= chess1 <= 7 and 1 <= chess2 <= 7) \
-               or (8 <= chess1 <= 14 and 8 <= chess2 <= 14)
+        # 棋盘变了, 丢掉上一回合的合法走法. 只允许合法走法, 将帅不会被吃掉, 轮到的一方无棋可走就是被将死或者困毙
+        self.rules.invalidate()
+        if self.game_state in (GameState.RED, GameState.BLACK) and not self.rules.legal_moves(self.chess, self.side()):
+            self.game_state = GameState.BLACK_WIN if self.game_state == GameState.RED else GameState.RED_WIN
 
 
 if __name__ == '__main__':
@@ -22,6 +22,7 @@ class Chessman:
     R_BISHOP = 12  # 红仕
     R_ELEPHANT = 13  # 红相
     R_PAWN = 14  # 红兵
+    OUT = 15  # 棋盘外的哨兵
 
 
 class Constants:
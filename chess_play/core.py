@@ -16,26 +16,533 @@
         其中, move_number是棋子的合法走法数量, move_value是棋子每一走法的价值
         3) 棋子关系的评估
 
+棋盘表示:
+    搜索内部使用一维棋盘(bytearray), 每行16格, 共14行, 真实的10行9列棋盘位于第2~11行、第3~11列,
+    其余位置填充哨兵Chessman.OUT. 马、象等走出棋盘时会落在哨兵上, 因此不再需要 x < 9 and y < 10
+    之类的边界判断, 一个位置也只需要一个整数下标. 上下移动一格下标相差16, 左右移动一格相差1.
+    界面仍然使用10 \times 9的二维列表, 只在搜索的根节点转换一次.
+    引擎只有一种方向: 第0行是黑方底线, 红子总在下方. 走法表、九宫、过河都按这个方向建立, 走法产生中没有方向判断;
+    界面上红子在上方时, 由界面和网络收发的地方用flip_chess/flip_point转换.
 '''
 from typing import *
 from chess_play.constants import *
+from array import array
 import copy
+import random
+import time
 
+BOARD_WIDTH = 16  # 一维棋盘每行的格数
+BOARD_HEIGHT = 14  # 一维棋盘的行数
+BOARD_SIZE = BOARD_WIDTH * BOARD_HEIGHT
+RANK_TOP = 2  # 第0行在一维棋盘中的行号
+FILE_LEFT = 3  # 第0列在一维棋盘中的列号
 
-class ChessmanPosition:
 
-    def __init__(self) -> None:
-        self.x = 0
-        self.y = 0
+def square(i: int, j: int) -> int:
+    '''
+    二维坐标转一维棋盘下标
+    :param i: 行
+    :param j: 列
+    :return:
+    '''
+    return ((i + RANK_TOP) << 4) + j + FILE_LEFT
+
 
+def rank_of(sq: int) -> int:
+    '''
+    一维棋盘下标所在的行
+    :param sq:
+    :return:
+    '''
+    return (sq >> 4) - RANK_TOP
 
-class ChessmanMove:
 
-    def __init__(self) -> None:
-        self.chess_id = None  # 棋子
-        self.fron = ChessmanPosition()
-        self.to = ChessmanPosition()
-        self.score = 0
+def file_of(sq: int) -> int:
+    '''
+    一维棋盘下标所在的列
+    :param sq:
+    :return:
+    '''
+    return (sq & 15) - FILE_LEFT
+
+
+def in_palace(sq: int, red: bool) -> bool:
+    '''
+    判断位置是否在九宫之内, 红方九宫在下方, 黑方九宫在上方
+    :param sq:
+    :param red: 是否是红方的九宫
+    :return:
+    '''
+    i, j = rank_of(sq), file_of(sq)
+    if j < 3 or j > 5:
+        return False
+    if red:
+        return 7 <= i <= 9
+    return 0 <= i <= 2
+
+
+SQUARES = [square(i, j) for i in range(10) for j in range(9)]  # 棋盘上的90个位置, 按行排列
+PALACE_SQUARES = [square(i, j) for i in (0, 1, 2, 7, 8, 9) for j in range(3, 6)]  # 两个九宫的18个位置
+KING_DELTAS = (-16, -1, 1, 16)  # 将帅上下左右
+ADVISOR_DELTAS = (-17, -15, 15, 17)  # 仕斜走
+ELEPHANT_DELTAS = (-34, -30, 30, 34)  # 象走田, 象眼位于 sq + delta // 2
+HORSE_DELTAS = (-33, -31, -18, -14, 14, 18, 31, 33)  # 马走日
+HORSE_LEGS = (-16, -16, -1, 1, -1, 1, 16, 16)  # 与HORSE_DELTAS一一对应的马腿偏移
+
+
+def new_board() -> bytearray:
+    '''
+    创建一个空的一维棋盘, 棋盘外填充哨兵
+    :return:
+    '''
+    board = bytearray([Chessman.OUT]) * BOARD_SIZE
+    for sq in SQUARES:
+        board[sq] = Chessman.NOCHESS
+    return board
+
+
+def board_from_list(chess: List[List[int]]) -> bytearray:
+    '''
+    界面使用的10 \times 9棋盘转成一维棋盘
+    :param chess:
+    :return:
+    '''
+    board = new_board()
+    for sq in SQUARES:
+        board[sq] = chess[rank_of(sq)][file_of(sq)]
+    return board
+
+
+def board_to_list(board: bytearray) -> List[List[int]]:
+    '''
+    一维棋盘转回界面使用的10 \times 9棋盘
+    :param board:
+    :return:
+    '''
+    return [[board[square(i, j)] for j in range(9)] for i in range(10)]
+
+
+def flip_chess(chess: List[List[int]]) -> List[List[int]]:
+    '''
+    10 \times 9棋盘上下翻转. 引擎内部总是红子在下方, 界面上红子在上方时, 只在界面和网络的边界上用它转换
+    :param chess:
+    :return: 新的棋盘, 翻转两次得到原来的棋盘
+    '''
+    return [row[:] for row in reversed(chess)]
+
+
+def flip_point(i: int, j: int) -> Tuple[int, int]:
+    '''
+    上下翻转后的坐标, 与flip_chess对应
+    :param i: 行
+    :param j: 列
+    :return:
+    '''
+    return 9 - i, j
+
+
+def board_values(values: List[List[int]]) -> List[int]:
+    '''
+    10 \times 9的位置价值表转成按一维棋盘下标索引的数组
+    :param values:
+    :return:
+    '''
+    table = [0] * BOARD_SIZE
+    for sq in SQUARES:
+        table[sq] = values[rank_of(sq)][file_of(sq)]
+    return table
+
+
+MOVE_STACK_SIZE = 8192  # 走法栈的初始容量, 不够时自动扩大
+MAX_GEN_MOVES = 256  # 一个局面一方最多的走法数, 每产生一层走法前保证走法栈至少还有这么多空位
+
+
+def move_code(fron: int, to: int) -> int:
+    '''
+    走法编码成一个整数: 起点 << 8 | 终点
+    :param fron: 起始位置
+    :param to: 目标位置
+    :return:
+    '''
+    return fron << 8 | to
+
+
+def move_src(move: int) -> int:
+    '''
+    走法的起始位置
+    :param move:
+    :return:
+    '''
+    return move >> 8
+
+
+def move_dst(move: int) -> int:
+    '''
+    走法的目标位置
+    :param move:
+    :return:
+    '''
+    return move & 255
+
+
+def mirror_square(sq: int) -> int:
+    '''
+    左右镜像后的位置: 第j列变成第8 - j列, 行不变
+    :param sq:
+    :return:
+    '''
+    return sq + 2 * FILE_LEFT + 8 - 2 * (sq & 15)
+
+
+def mirror_move(move: int) -> int:
+    '''
+    左右镜像后的走法, 镜像两次得到原来的走法, 所以同一个函数可以在两个方向上互相转换
+    :param move:
+    :return:
+    '''
+    return mirror_square(move >> 8) << 8 | mirror_square(move & 255)
+
+
+def in_half(sq: int, red: bool) -> bool:
+    '''
+    判断位置是否在己方半场(没有过河)
+    :param sq:
+    :param red: 是否是红方的半场
+    :return:
+    '''
+    if red:
+        return rank_of(sq) >= 5
+    return rank_of(sq) <= 4
+
+
+# 棋子属于哪一方: 黑子为0, 红子为1, 空位为2, 哨兵为3, 于是 PIECE_SIDE[c] != side 表示c是空位或者对方棋子
+PIECE_SIDE = (2, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 3)
+# 走法目标过滤表, 用 targets[PIECE_SIDE[c]] 判断目标位置c是否需要产生走法, 下标为走棋的一方
+TARGETS_ALL = ((False, True, True, False), (True, False, True, False))  # 空位或对方棋子
+TARGETS_CAPTURE = ((False, True, False, False), (True, False, False, False))  # 只有对方棋子
+TARGETS_QUIET = ((False, False, True, False), (False, False, True, False))  # 只有空位
+# 吃子走法排序(MVV-LVA)用的棋子价值, 下标为棋子编号: 先吃价值大的, 同样的被吃子先用价值小的去吃
+MVV_VALUE = (0, 6, 5, 3, 3, 2, 2, 1, 6, 5, 3, 3, 2, 2, 1, 0)
+
+# 预先计算好的走法表, 在导入模块时建立一次, 下标为一维棋盘上的位置
+KING_MOVES = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # KING_MOVES[side][sq]: 将帅在九宫内能到达的位置
+ADVISOR_MOVES = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # ADVISOR_MOVES[side][sq]: 仕能到达的位置
+ELEPHANT_MOVES = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # ELEPHANT_MOVES[side][sq]: (目标位置, 象眼)
+HORSE_MOVES = [()] * BOARD_SIZE  # HORSE_MOVES[sq]: (目标位置, 马腿)
+HORSE_ATTACKERS = [()] * BOARD_SIZE  # 反查能攻击sq的马: (马所在位置, 马腿)
+PAWN_ATTACKERS = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # PAWN_ATTACKERS[side][sq]: 能攻击sq的兵卒所在的位置
+PAWN_MOVES = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # PAWN_MOVES[side][sq]: 兵卒能走到的位置
+
+
+def init_move_tables():
+    '''
+    建立将帅、仕、象、马的走法表, 出界、出九宫、过河的走法在这里就已经排除了,
+    生成走法时只需要查表, 再检查一次马腿/象眼和目标位置即可
+    '''
+    on_board = set(SQUARES)
+    for side in (0, 1):
+        red = side == 1
+        for sq in SQUARES:
+            if in_palace(sq, red):
+                KING_MOVES[side][sq] = tuple(sq + delta for delta in KING_DELTAS if in_palace(sq + delta, red))
+                ADVISOR_MOVES[side][sq] = tuple(sq + delta for delta in ADVISOR_DELTAS
+                                                if in_palace(sq + delta, red))
+            if in_half(sq, red):
+                ELEPHANT_MOVES[side][sq] = tuple((sq + delta, sq + delta // 2) for delta in ELEPHANT_DELTAS
+                                                 if sq + delta in on_board and in_half(sq + delta, red))
+    attackers = {sq: [] for sq in SQUARES}
+    for sq in SQUARES:
+        HORSE_MOVES[sq] = tuple((sq + delta, sq + leg) for delta, leg in zip(HORSE_DELTAS, HORSE_LEGS)
+                                if sq + delta in on_board)
+        for to, leg in HORSE_MOVES[sq]:
+            attackers[to].append((sq, leg))
+    for sq in SQUARES:
+        HORSE_ATTACKERS[sq] = tuple(attackers[sq])
+        # 红兵从下方(sq + 16)攻击sq, 过河后(sq在第0~4行)还能从左右攻击; 黑卒相反
+        for side, behind, crossed in ((1, 16, rank_of(sq) <= 4), (0, -16, rank_of(sq) >= 5)):
+            froms = [sq + behind] + ([sq - 1, sq + 1] if crossed else [])
+            PAWN_ATTACKERS[side][sq] = tuple(fron for fron in froms if fron in on_board)
+            # 兵卒自己过河后(sq所在的行)才能左右走
+            tos = [sq - behind] + ([sq - 1, sq + 1] if not in_half(sq, side == 1) else [])
+            PAWN_MOVES[side][sq] = tuple(to for to in tos if to in on_board)
+
+
+init_move_tables()
+
+
+RANK_BIT = [0] * BOARD_SIZE  # 位置在所在行占用位图中的比特, 行位图共9位, 第j列对应第j位
+FILE_BIT = [0] * BOARD_SIZE  # 位置在所在列占用位图中的比特, 列位图共10位, 第i行对应第i位
+# 车、炮在一行(列)上的走法表, 用法 RANK_SLIDES[sq][行位图] / FILE_SLIDES[sq][列位图], 每一项是三个偏移量元组:
+# (不吃子能走到的空位, 车能吃到的位置即两个方向上的第一个棋子, 炮能吃到的位置即两个方向上炮架后的第一个棋子)
+# 偏移量加上sq就是目标位置, 吃子的目标是己方棋子时需要调用方排除
+RANK_SLIDES = [None] * BOARD_SIZE
+FILE_SLIDES = [None] * BOARD_SIZE
+
+
+def slide_table(length: int, unit: int) -> List[List[Tuple[tuple, tuple, tuple]]]:
+    '''
+    为长度为length的一条线建立走法表, table[p][occ]对应棋子在第p格、线上占用位图为occ的情况
+    :param length: 9表示一行, 10表示一列
+    :param unit: 相邻两格在一维棋盘上的下标差, 行为1, 列为16
+    :return:
+    '''
+    cache = {}  # 相同的偏移量元组只保存一份
+    table = []
+    for p in range(length):
+        entries = []
+        for occ in range(1 << length):
+            moves, car_caps, cannon_caps = [], [], []
+            for direction in (1, -1):
+                q = p + direction
+                while 0 <= q < length and not occ >> q & 1:
+                    moves.append((q - p) * unit)
+                    q += direction
+                if 0 <= q < length:
+                    car_caps.append((q - p) * unit)
+                    q += direction
+                    while 0 <= q < length and not occ >> q & 1:
+                        q += direction
+                    if 0 <= q < length:
+                        cannon_caps.append((q - p) * unit)
+            entry = (tuple(moves), tuple(car_caps), tuple(cannon_caps))
+            entries.append(cache.setdefault(entry, entry))
+        table.append(entries)
+    return table
+
+
+def init_slide_tables():
+    '''
+    建立车、炮的行列走法表, 同一列上的位置共用一张行走法表, 同一行上的位置共用一张列走法表
+    '''
+    rank_table = slide_table(9, 1)
+    file_table = slide_table(10, 16)
+    for sq in SQUARES:
+        RANK_BIT[sq] = 1 << file_of(sq)
+        FILE_BIT[sq] = 1 << rank_of(sq)
+        RANK_SLIDES[sq] = rank_table[file_of(sq)]
+        FILE_SLIDES[sq] = file_table[rank_of(sq)]
+
+
+init_slide_tables()
+
+# 攻击图增量更新用的表
+BIT_INDICES = [tuple(k for k in range(10) if occ >> k & 1) for occ in range(1024)]  # 行列位图中为1的各位
+LINE_PIECE = tuple(id in (Chessman.B_KING, Chessman.B_CAR, Chessman.B_CANNON,
+                          Chessman.R_KING, Chessman.R_CAR, Chessman.R_CANNON) for id in range(16))  # 受行列占用影响
+HORSE_PIECE = tuple(id in (Chessman.B_HORSE, Chessman.R_HORSE) for id in range(16))
+ELEPHANT_PIECE = tuple(id in (Chessman.B_ELEPHANT, Chessman.R_ELEPHANT) for id in range(16))
+
+
+ZOBRIST_SEED = 20190101  # 固定种子, 保证每次运行得到相同的键值, 置换表、开局库才能跨进程使用
+ZOBRIST = [[0] * BOARD_SIZE for _ in range(Chessman.OUT)]  # ZOBRIST[棋子][位置]: 64位随机键值
+ZOBRIST_SIDE = 0  # 轮到红方走时异或上这个键值
+# ZOBRIST_MIRROR[棋子][位置] = ZOBRIST[棋子][mirror_square(位置)], 用来增量计算左右镜像局面的哈希值
+ZOBRIST_MIRROR = [[0] * BOARD_SIZE for _ in range(Chessman.OUT)]
+
+
+def init_zobrist_tables():
+    '''
+    初始化Zobrist键值表, 只给棋盘上的90个位置生成键值
+    :return:
+    '''
+    global ZOBRIST_SIDE
+    rng = random.Random(ZOBRIST_SEED)
+    for id in range(Chessman.B_KING, Chessman.OUT):
+        for sq in SQUARES:
+            ZOBRIST[id][sq] = rng.getrandbits(64)
+    ZOBRIST_SIDE = rng.getrandbits(64)
+    for id in range(Chessman.B_KING, Chessman.OUT):
+        for sq in SQUARES:
+            ZOBRIST_MIRROR[id][sq] = ZOBRIST[id][mirror_square(sq)]
+
+
+init_zobrist_tables()
+
+
+def zobrist_hash(chess: bytearray, side: int, keys: List[List[int]] = ZOBRIST) -> int:
+    '''
+    从头计算局面的Zobrist哈希值, 搜索中的哈希值由make_move/un_make_move增量更新, 这里用来初始化和校验
+    :param chess: 一维棋盘
+    :param side: 轮到哪一方走, 1为红方, 0为黑方
+    :param keys: 键值表, 传入ZOBRIST_MIRROR得到左右镜像局面的哈希值
+    :return:
+    '''
+    key = ZOBRIST_SIDE if side else 0
+    for sq in SQUARES:
+        id = chess[sq]
+        if id != Chessman.NOCHESS:
+            key ^= keys[id][sq]
+    return key
+
+
+# FEN中的棋子字母, 下标为棋子编号: 红方大写, 黑方小写. k将 a仕 b象 n马 r车 c炮 p兵
+FEN_CHARS = ' krncabpKRNCABP'
+FEN_PIECES = {c: id for id, c in enumerate(FEN_CHARS) if c != ' '}
+FEN_PIECES.update({'h': Chessman.B_HORSE, 'e': Chessman.B_ELEPHANT,
+                   'H': Chessman.R_HORSE, 'E': Chessman.R_ELEPHANT})  # 有些软件用h表示马, e表示象
+START_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1'  # 初始局面
+
+
+def board_from_fen(fen: str) -> Tuple[bytearray, int, int]:
+    '''
+    解析象棋FEN, 直接得到一维棋盘. 第一段是棋盘, 从黑方底线(第0行)写起, 数字表示连续的空位;
+    第二段是轮到哪一方走, w或r为红方, b为黑方, 省略时为红方. 第五段是自然着法计数(最近一次吃子以来走了多少步),
+    省略时为0. 其余的段(回合数等)忽略
+    :param fen:
+    :return: (一维棋盘, 轮到哪一方走, 自然着法计数)
+    '''
+    fields = fen.split()
+    if not fields:
+        raise ValueError('空的FEN')
+    rows = fields[0].split('/')
+    if len(rows) != 10:
+        raise ValueError('FEN应该有10行: {}'.format(fen))
+    board = new_board()
+    for i, row in enumerate(rows):
+        j = 0
+        for c in row:
+            if c.isdigit():
+                j += int(c)
+            elif c in FEN_PIECES and j < 9:
+                board[square(i, j)] = FEN_PIECES[c]
+                j += 1
+            else:
+                raise ValueError('FEN第{}行有无效的字符{}: {}'.format(i, c, fen))
+        if j != 9:
+            raise ValueError('FEN第{}行不是9列: {}'.format(i, fen))
+    if len(fields) < 2 or fields[1] in ('w', 'r'):
+        side = 1
+    elif fields[1] == 'b':
+        side = 0
+    else:
+        raise ValueError('FEN中无效的走棋方{}: {}'.format(fields[1], fen))
+    quiet = 0
+    if len(fields) >= 5:
+        if not fields[4].isdigit():
+            raise ValueError('FEN中无效的自然着法计数{}: {}'.format(fields[4], fen))
+        quiet = int(fields[4])
+    return board, side, quiet
+
+
+def board_to_fen(board: bytearray, side: int, quiet: int = 0) -> str:
+    '''
+    一维棋盘转成象棋FEN
+    :param board:
+    :param side: 轮到哪一方走, 1为红方, 0为黑方
+    :param quiet: 自然着法计数, 最近一次吃子以来走了多少步
+    :return:
+    '''
+    rows = []
+    for i in range(10):
+        row, empty = '', 0
+        for j in range(9):
+            id = board[square(i, j)]
+            if id == Chessman.NOCHESS:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            row += FEN_CHARS[id]
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    return '{} {} - - {} 1'.format('/'.join(rows), 'w' if side else 'b', quiet)
+
+
+def read_epd(source: Union[str, Iterable[str]]) -> Iterator[Tuple[str, Dict[str, str]]]:
+    '''
+    逐行读取EPD格式的局面文件, 每次产生一个局面, 不会把整个文件的局面都放进内存.
+    每行是一个FEN, 后面可以跟若干以分号分隔的操作, 例如 "... w - - 0 1; D1 44; D2 1920";
+    空行和#开头的行跳过
+    :param source: 文件名, 或者是逐行产生文本的对象(打开的文件、字符串列表等)
+    :return: (FEN, {操作名: 操作数})
+    '''
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            yield from read_epd(f)
+        return
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(';')
+        ops = {}
+        for op in fields[1:]:
+            op = op.strip()
+            if op:
+                name, _, operand = op.partition(' ')
+                ops[name] = operand.strip().strip('"')
+        yield fields[0].strip(), ops
+
+
+class ChessmanPosition(NamedTuple):
+    '''
+    棋盘上的一个位置, 对外接口(界面、网络、分析结果)使用的不可变记录
+    与原来的ChessmanPosition一样, x为列号(0~8, 横坐标), y为行号(0~9, 纵坐标), 二维列表下标是chess[y][x]
+    '''
+    x: int = 0
+    y: int = 0
+
+    @classmethod
+    def from_square(cls, sq: int) -> 'ChessmanPosition':
+        '''
+        由一维棋盘下标得到位置
+        :param sq:
+        :return:
+        '''
+        return cls(file_of(sq), rank_of(sq))
+
+    def square(self) -> int:
+        '''
+        转换成一维棋盘下标
+        :return:
+        '''
+        return square(self.y, self.x)
+
+
+class ChessmanMove(NamedTuple):
+    '''
+    一步走法, 对外接口使用的不可变记录, 可以直接比较和放进集合、字典
+    搜索内部只使用move_code编码的整数, 只有在交给外部时才转换成ChessmanMove
+    '''
+    fron: ChessmanPosition  # 起始位置
+    to: ChessmanPosition  # 目标位置
+    chess_id: int = Chessman.NOCHESS  # 走动的棋子
+    score: int = 0  # 走法的分值, 排序或者分析结果使用
+
+    @classmethod
+    def from_code(cls, move: int, chess_id: int = Chessman.NOCHESS) -> 'ChessmanMove':
+        '''
+        由move_code编码的走法得到走法记录
+        :param move:
+        :param chess_id: 走动的棋子
+        :return:
+        '''
+        return cls(ChessmanPosition.from_square(move >> 8),
+                   ChessmanPosition.from_square(move & 255), chess_id)
+
+    def code(self) -> int:
+        '''
+        转换成move_code编码的走法
+        :return:
+        '''
+        return move_code(self.fron.square(), self.to.square())
+
+    def mirror(self) -> 'ChessmanMove':
+        '''
+        左右镜像后的走法
+        :return:
+        '''
+        return self._replace(fron=ChessmanPosition(8 - self.fron.x, self.fron.y),
+                             to=ChessmanPosition(8 - self.to.x, self.to.y))
+
+    def to_list(self) -> List[int]:
+        '''
+        转换成界面和网络使用的[起始行, 起始列, 目标行, 目标列]
+        :return:
+        '''
+        return [self.fron.y, self.fron.x, self.to.y, self.to.x]
 
 
 class MoveGenerator:
@@ -45,10 +552,13 @@ class MoveGenerator:
 
     def __init__(self) -> None:
         super().__init__()
-        # 8 \times 80, 用来存放ChessmanMove队列
-        self.move_list = [[ChessmanMove()] * 80 for _ in range(8)]
-        self.move_cnt = 0  # 记录move_list中走法的数量
-        self.up_red = False
+        # 所有层的走法都放在同一个预先分配好的走法栈里, 每个走法是move_code编码后的整数,
+        # 第ply层的走法位于 moves[ply_start[ply]:ply_start[ply + 1]], 搜索深度和每层的走法数都不受限制
+        self.moves = array('i', [0]) * MOVE_STACK_SIZE
+        self.ply_start = [0] * 64
+        self.move_cnt = 0  # 走法栈的栈顶
+        self.targets = TARGETS_ALL[0]  # 当前产生哪些目标位置的走法, 由gen_moves设定
+        self.killers = [[0, 0] for _ in range(64)]  # 每一层最近两个引起截断的不吃子走法
 
     def same(self, chess1, chess2):
         '''
@@ -60,123 +570,88 @@ class MoveGenerator:
         return (1 <= chess1 <= 7 and 1 <= chess2 <= 7) \
                or (8 <= chess1 <= 14 and 8 <= chess2 <= 14)
 
-    def is_valid_move(self, chess, old_idx_j, old_idx_i, idx_j, idx_i):
+    def is_valid_move(self, chess: bytearray, fron: int, to: int) -> bool:
         '''
         判断目标位置是否合法
-        :param idx_i: 目标位置的row
-        :param idx_j: 目标位置的col
+        :param chess: 一维棋盘
+        :param fron: 起始位置
+        :param to: 目标位置
         :return:
         '''
-        old_c, c = chess[old_idx_i][old_idx_j], chess[idx_i][idx_j]
-        # 1. 如果目标位置是己方棋子则无效
+        old_c, c = chess[fron], chess[to]
+        # 1. 目标位置在棋盘外则无效
+        if c == Chessman.OUT:
+            return False
+        # 2. 如果目标位置是己方棋子则无效
         if self.same(old_c, c):
             # print('目标位置是己方棋子, 下棋无效')
             return False
         # 3. 判断棋子的走法是否符合规则
+        old_idx_i, old_idx_j = rank_of(fron), file_of(fron)
+        idx_i, idx_j = rank_of(to), file_of(to)
         width, height = abs(idx_j - old_idx_j), abs(idx_i - old_idx_i)
         if old_c == Chessman.B_KING or old_c == Chessman.R_KING:  # 帅
             # 是否是一条直线杀对方的将军
             if width == 0 and height > 2:
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if chess[i][old_idx_j] != Chessman.NOCHESS:
+                for sq in range(min(fron, to) + 16, max(fron, to), 16):
+                    if chess[sq] != Chessman.NOCHESS:
                         return False
                 return old_c + c == 9  # 目的地是对方将领
             # 只能移动一个位置, 上下左右
             if width + height != 1:
                 return False
             # 不能出大帐
-            if idx_j < 3 or idx_j > 5:
+            if not in_palace(to, old_c == Chessman.R_KING):
                 return False
-            if old_c == Chessman.B_KING:
-                if self.up_red:
-                    if idx_i < 7:
-                        return False
-                else:
-                    if idx_i > 2:
-                        return False
-            else:
-                if self.up_red:
-                    if idx_i > 2:
-                        return False
-                else:
-                    if idx_i < 7:
-                        return False
         elif old_c == Chessman.B_CAR or old_c == Chessman.R_CAR:  # 车
             # 车不能拐弯
             if width > 0 and height > 0:
                 return False
-            # 中间不能有其他棋子
-            if width > 0:  # 横着走
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if chess[idx_i][i] != Chessman.NOCHESS:
-                        return False
-            else:  # 竖着走
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if chess[i][old_idx_j] != Chessman.NOCHESS:
-                        return False
+            # 中间不能有其他棋子, 横着走步长为1, 竖着走步长为16
+            step = 1 if width > 0 else 16
+            for sq in range(min(fron, to) + step, max(fron, to), step):
+                if chess[sq] != Chessman.NOCHESS:
+                    return False
             return True  # 不能拐弯
         elif old_c == Chessman.B_HORSE or old_c == Chessman.R_HORSE:  # 马
             if width == 2 and height == 1:
-                mid = (old_idx_j + idx_j) // 2
-                if chess[old_idx_i][mid] != Chessman.NOCHESS:
-                    return False
+                leg = fron + (idx_j - old_idx_j) // 2
             elif width == 1 and height == 2:
-                mid = (old_idx_i + idx_i) // 2
-                if chess[mid][old_idx_j] != Chessman.NOCHESS:
-                    return False
+                leg = fron + (idx_i - old_idx_i) // 2 * 16
             else:
                 return False
+            if chess[leg] != Chessman.NOCHESS:
+                return False
         elif old_c == Chessman.B_CANNON or old_c == Chessman.R_CANNON:  # 炮
             # 炮也不能拐弯
             if width > 0 and height > 0:
                 return False
             # 炮要吃子的话, 必须中间有炮架
-            if width > 0:  # 横着走
-                cnt = 0  # 计算中间有多少个棋子
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if chess[idx_i][i] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS:
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
-            else:  # 竖着走
-                cnt = 0
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if chess[i][old_idx_j] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS:
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
+            step = 1 if width > 0 else 16
+            cnt = 0  # 计算中间有多少个棋子
+            for sq in range(min(fron, to) + step, max(fron, to), step):
+                if chess[sq] != Chessman.NOCHESS:
+                    cnt += 1
+            if cnt == 0 and c == Chessman.NOCHESS:
+                return True
+            elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
+                return True
+            return False
         elif old_c == Chessman.B_BISHOP or old_c == Chessman.R_BISHOP:  # 仕
             # 只能走斜线
             if not (width == 1 and height == 1):
                 return False
             # 跟将军一样只能在九宫格内
-            if idx_j < 3 or idx_j > 5:
+            if not in_palace(to, old_c == Chessman.R_BISHOP):
                 return False
-            if old_c == Chessman.B_BISHOP:  # 黑仕
-                if self.up_red:
-                    if idx_i < 7:
-                        return False
-                else:
-                    if idx_i > 2:
-                        return False
-            else:  # 红仕
-                if self.up_red:
-                    if idx_i > 2:
-                        return False
-                else:
-                    if idx_i < 7:
-                        return False
         elif old_c == Chessman.B_ELEPHANT or old_c == Chessman.R_ELEPHANT:  # 相
             if not (width == 2 and height == 2):
                 return False
-            mid_i, mid_j = (idx_i + old_idx_i) // 2, (idx_j + old_idx_j) // 2
-            if chess[mid_i][mid_j] != Chessman.NOCHESS:
+            # 象不能过河
+            if not in_half(to, old_c == Chessman.R_ELEPHANT):
+                return False
+            # 田字的中心就是象眼
+            if chess[(fron + to) // 2] != Chessman.NOCHESS:
                 return False
             return True
         elif old_c == Chessman.B_PAWN or old_c == Chessman.R_PAWN:  # 兵
@@ -184,327 +659,484 @@ class MoveGenerator:
             if width + height != 1:
                 return False
             if old_c == Chessman.B_PAWN:  # 黑兵
-                if self.up_red:
-                    if idx_i > old_idx_i:
-                        return False
-                    # 没过界只能往前
-                    if old_idx_i >= 5:
-                        if width != 0:
-                            return False
-                else:
-                    if idx_i < old_idx_i:
+                if idx_i < old_idx_i:
+                    return False
+                # 没过界只能往前
+                if old_idx_i <= 4:
+                    if width != 0:
                         return False
-                    if old_idx_i <= 4:
-                        if width != 0:
-                            return False
             else:  # 红兵
-                if self.up_red:
-                    if idx_i < old_idx_i:
-                        return False
-                    if old_idx_i <= 4:
-                        if width != 0:
-                            return False
-                else:
-                    if idx_i > old_idx_i:
+                if idx_i > old_idx_i:
+                    return False
+                # 没过界只能往前
+                if old_idx_i >= 5:
+                    if width != 0:
                         return False
-                    # 没过界只能往前
-                    if old_idx_i >= 5:
-                        if width != 0:
-                            return False
             return True
         return True
 
-    def add_move(self, from_x: int, from_y: int, to_x: int, to_y: int, play: int) -> int:
+    def add_move(self, fron: int, to: int) -> int:
         '''
-        将走法添加进move_list当中
-        :param from_x: 起始位置横坐标
-        :param from_y: 其实位置纵坐标
-        :param to_x: 目标位置横坐标
-        :param to_y: 目标位置纵坐标
-        :param play: 此走法所在的层次
+        将走法压入走法栈
+        :param fron: 起始位置
+        :param to: 目标位置
         :return:
         '''
-        self.move_list[play][self.move_cnt].fron.x = from_x
-        self.move_list[play][self.move_cnt].fron.y = from_y
-        self.move_list[play][self.move_cnt].to.x = to_x
-        self.move_list[play][self.move_cnt].to.y = to_y
+        self.moves[self.move_cnt] = fron << 8 | to
         self.move_cnt += 1  # 计数器
         return self.move_cnt
 
+    def begin_ply(self, ply: int, append: bool = False):
+        '''
+        开始产生第ply层的走法, 走法从ply_start[ply]处开始写入
+        :param ply: 距离根节点的层数, 第ply层的走法紧接在第ply - 1层之后
+        :param append: 接在这一层已经产生的走法后面继续写入, 分阶段产生走法时使用
+        :return:
+        '''
+        self.move_cnt = self.ply_start[ply + 1] if append else self.ply_start[ply]
+        if self.move_cnt + MAX_GEN_MOVES > len(self.moves):
+            self.moves.extend(array('i', [0]) * len(self.moves))  # 容量翻倍
+
+    def end_ply(self, ply: int) -> int:
+        '''
+        结束第ply层的走法产生, 记下下一层的起点
+        :param ply:
+        :return: 第ply层的走法数量
+        '''
+        if ply + 1 >= len(self.ply_start):
+            self.ply_start.extend([0] * len(self.ply_start))
+        self.ply_start[ply + 1] = self.move_cnt
+        return self.move_cnt - self.ply_start[ply]
+
     def is_red(self, id):
         return 8 <= id <= 14
 
     def is_black(self, id):
         return 1 <= id <= 7
 
-    def create_possible_move(self, chess: List[List[int]], ply: int, side: int) -> int:
+    def create_possible_move(self, pos: 'SearchEngine', ply: int, side: int) -> int:
         '''
         走法产生器, 产生一层的所有可能的走法
-        :param chess: 棋盘
-        :param ply: 搜索的层数
+        :param pos: 当前局面, 提供一维棋盘chess以及双方的棋子列表pieces
+        :param ply: 距离根节点的层数, 走法写入moves[ply_start[ply]:ply_start[ply + 1]]
         :param side: 是否是红子
+        :return: 走法数量
+        '''
+        self.begin_ply(ply)
+        self.gen_moves(pos, side, TARGETS_ALL[side])
+        return self.end_ply(ply)
+
+    def gen_captures(self, pos: 'SearchEngine', ply: int, side: int, append: bool = False) -> int:
+        '''
+        只产生吃子走法
+        :param pos:
+        :param ply:
+        :param side:
+        :param append: 接在这一层已经产生的走法后面
+        :return: 这一层的走法数量
+        '''
+        self.begin_ply(ply, append)
+        self.gen_moves(pos, side, TARGETS_CAPTURE[side])
+        return self.end_ply(ply)
+
+    def gen_quiets(self, pos: 'SearchEngine', ply: int, side: int, append: bool = False) -> int:
+        '''
+        只产生不吃子的走法
+        :param pos:
+        :param ply:
+        :param side:
+        :param append: 接在这一层已经产生的走法后面
+        :return: 这一层的走法数量
+        '''
+        self.begin_ply(ply, append)
+        self.gen_moves(pos, side, TARGETS_QUIET[side])
+        return self.end_ply(ply)
+
+    def gen_checks(self, pos: 'SearchEngine', ply: int, side: int, append: bool = False) -> int:
+        '''
+        只产生将军的走法(包括吃子将军、闪击、架炮).
+        从对方将帅的位置出发找候选走法: 不在将帅所在行列、也不是马腿位置上的车炮, 只可能走到将帅所在行列的
+        两个交点上去将军, 直接用is_valid_move检查这两步, 不产生它们其余的平移走法;
+        其他棋子产生走法后, 只保留落点能直接攻击将帅、或者离开/走到将帅所在行列、离开马腿的走法.
+        候选走法最后试走一步确认确实将军. 对方已经被将军时(只在不合法的局面中出现), 每一步都要试走
+        :param pos: 当前局面, 需要提供make_move/un_make_move/in_check
+        :param ply:
+        :param side: 将军的一方
+        :param append: 接在这一层已经产生的走法后面
+        :return: 这一层的走法数量
+        '''
+        self.begin_ply(ply, append)
+        king = pos.kings[side ^ 1]
+        if not king:
+            return self.end_ply(ply)
+        chess = pos.chess
+        begin = self.move_cnt
+        rank, file = king >> 4, king & 15
+        checked = pos.in_check(side ^ 1)
+        self.targets = TARGETS_ALL[side]
+        car, cannon = (Chessman.R_CAR, Chessman.R_CANNON) if side else (Chessman.B_CAR, Chessman.B_CANNON)
+        horse, pawn = (Chessman.R_HORSE, Chessman.R_PAWN) if side else (Chessman.B_HORSE, Chessman.B_PAWN)
+        for sq in pos.pieces[side]:
+            id = chess[sq]
+            if (id == car or id == cannon) and not checked and sq >> 4 != rank and sq & 15 != file \
+                    and sq - king not in ADVISOR_DELTAS:
+                for to in ((sq & 0xf0) | file, (rank << 4) | (sq & 15)):
+                    if self.is_valid_move(chess, sq, to):
+                        self.add_move(sq, to)
+            else:
+                self.gen_piece_move(pos, sq)
+        horse_checks = [fron for fron, leg in HORSE_ATTACKERS[king]]
+        pawn_checks = PAWN_ATTACKERS[side][king]
+        moves = self.moves
+        end = begin
+        for i in range(begin, self.move_cnt):
+            move = moves[i]
+            fron, to = move >> 8, move & 255
+            id = chess[fron]
+            if checked or to >> 4 == rank or to & 15 == file or fron >> 4 == rank or fron & 15 == file \
+                    or fron - king in ADVISOR_DELTAS \
+                    or id == horse and to in horse_checks or id == pawn and to in pawn_checks:
+                chess_id = pos.make_move(move)
+                check = pos.in_check(side ^ 1)
+                pos.un_make_move(move, chess_id)
+                if check:
+                    moves[end] = move
+                    end += 1
+        self.move_cnt = end
+        return self.end_ply(ply)
+
+    def gen_moves(self, pos: 'SearchEngine', side: int, targets: Tuple[bool, bool, bool, bool]):
+        '''
+        产生side一方目标位置满足targets的走法, 压入走法栈
+        :param pos:
+        :param side:
+        :param targets: TARGETS_ALL/TARGETS_CAPTURE/TARGETS_QUIET中的一项
         :return:
         '''
-        self.move_cnt = 0
-        # 枚举每一个棋子, 然后分别生成它们可走的路
-        for i in range(10):
-            for j in range(9):
-                if chess[i][j] != Chessman.NOCHESS:
-                    id = chess[i][j]
-                    if not side and self.is_red(id):
-                        continue  # 如果要产生黑棋走法, 跳过红棋
-                    if side and self.is_black(id):
-                        continue  # 如果要产生红旗走法, 黑棋跳过
-                    if id == Chessman.R_KING or id == Chessman.B_KING:
-                        self.gen_king_move(chess, i, j, ply)
-                    elif id == Chessman.R_BISHOP:
-                        self.gen_rbishop_move(chess, i, j, ply)
-                    elif id == Chessman.B_BISHOP:
-                        self.gen_bbishop_move(chess, i, j, ply)
-                    elif id == Chessman.R_ELEPHANT or id == Chessman.B_ELEPHANT:
-                        self.gen_elephant_move(chess, i, j, ply)
-                    elif id == Chessman.R_HORSE or id == Chessman.B_HORSE:
-                        self.gen_horse_move(chess, i, j, ply)
-                    elif id == Chessman.R_CAR or id == Chessman.B_CAR:
-                        self.gen_car_move(chess, i, j, ply)
-                    elif id == Chessman.R_PAWN:
-                        self.gen_rpawn_move(chess, i, j, ply)
-                    elif id == Chessman.B_PAWN:
-                        self.gen_bpawn_move(chess, i, j, ply)
-                    elif id == Chessman.B_CANNON or id == Chessman.R_CANNON:
-                        self.gen_cannon_move(chess, i, j, ply)
-        return self.move_cnt
+        self.targets = targets
+        # 只枚举己方棋子列表中的棋子, 然后分别生成它们可走的路
+        for sq in pos.pieces[side]:
+            self.gen_piece_move(pos, sq)
 
-    def gen_king_move(self, chess: List[List[int]], i: int, j: int, ply: int):
+    def gen_piece_move(self, pos: 'SearchEngine', sq: int):
         '''
-        产生国王的走法
-        :param chess:
-        :param i:
-        :param j:
+        产生sq上棋子的走法, 目标位置由self.targets过滤
+        :param pos:
+        :param sq:
+        :return:
+        '''
+        chess = pos.chess
+        id = chess[sq]
+        if id == Chessman.R_KING or id == Chessman.B_KING:
+            self.gen_king_move(pos, sq)
+        elif id == Chessman.R_BISHOP:
+            self.gen_rbishop_move(chess, sq)
+        elif id == Chessman.B_BISHOP:
+            self.gen_bbishop_move(chess, sq)
+        elif id == Chessman.R_ELEPHANT or id == Chessman.B_ELEPHANT:
+            self.gen_elephant_move(chess, sq)
+        elif id == Chessman.R_HORSE or id == Chessman.B_HORSE:
+            self.gen_horse_move(chess, sq)
+        elif id == Chessman.R_CAR or id == Chessman.B_CAR:
+            self.gen_car_move(pos, sq)
+        elif id == Chessman.R_PAWN:
+            self.gen_rpawn_move(chess, sq)
+        elif id == Chessman.B_PAWN:
+            self.gen_bpawn_move(chess, sq)
+        elif id == Chessman.B_CANNON or id == Chessman.R_CANNON:
+            self.gen_cannon_move(pos, sq)
+
+    def is_pseudo_legal(self, pos: 'SearchEngine', move: int, side: int) -> bool:
+        '''
+        判断一个不是在当前局面产生的走法(置换表走法、杀手走法)在当前局面能不能走
+        :param pos:
+        :param move:
+        :param side: 走棋的一方
+        :return:
+        '''
+        fron = move >> 8
+        return PIECE_SIDE[pos.chess[fron]] == side and self.is_valid_move(pos.chess, fron, move & 255)
+
+    def sort_captures(self, pos: 'SearchEngine', begin: int, end: int):
+        '''
+        按MVV-LVA给走法栈中[begin, end)的吃子走法排序
+        :param pos:
+        :param begin:
+        :param end:
+        :return:
+        '''
+        chess = pos.chess
+        ordered = sorted(self.moves[begin:end],
+                         key=lambda move: MVV_VALUE[chess[move & 255]] * 8 - MVV_VALUE[chess[move >> 8]],
+                         reverse=True)
+        self.moves[begin:end] = array('i', ordered)
+
+    def add_killer(self, ply: int, move: int):
+        '''
+        记录第ply层引起截断的不吃子走法
         :param ply:
+        :param move:
         :return:
         '''
-        for y in range(3):
-            for x in range(3, 6):
-                if self.is_valid_move(chess, j, i, x, y):
-                    self.add_move(j, i, x, y, ply)
-        for y in range(7, 10):
-            for x in range(3, 6):
-                if self.is_valid_move(chess, j, i, x, y):
-                    self.add_move(j, i, x, y, ply)
-
-    def gen_rbishop_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        for y in range(7, 10):
-            for x in range(3, 6):
-                if self.is_valid_move(chess, j, i, x, y):
-                    self.add_move(j, i, x, y, ply)
-
-    def gen_bbishop_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        for y in range(3):
-            for x in range(3, 6):
-                if self.is_valid_move(chess, j, i, x, y):
-                    self.add_move(j, i, x, y, ply)
-
-    def gen_elephant_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        # 插入右下方的有效走法
-        x, y = j + 2, i + 2
-        if x < 9 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入右上方的有效走法
-        x, y = j + 2, i - 2
-        if x < 9 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左下方的有效走法
-        x, y = j - 2, i + 2
-        if x >= 0 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左上方的有效走法
-        x, y = j - 2, i - 2
-        if x >= 0 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-
-    def gen_horse_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        # 插入右下方的有效走法
-        x, y = j + 2, i + 1
-        if x < 9 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入右上方的有效走法
-        x, y = j + 2, i - 1
-        if x < 9 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左下方的有效走法
-        x, y = j - 2, i + 1
-        if x >= 0 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左上方的有效走法
-        x, y = j - 2, i - 1
-        if x >= 0 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入右下方的有效走法
-        x, y = j + 1, i + 2
-        if x < 9 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左下方的有效走法
-        x, y = j - 1, i + 2
-        if x >= 0 and y < 10 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入右下方的有效走法
-        x, y = j + 1, i - 2
-        if x < 9 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-        # 插入左上方的有效走法
-        x, y = j - 1, i - 2
-        if x >= 0 and y >= 0 and self.is_valid_move(chess, j, i, x, y):
-            self.add_move(j, i, x, y, ply)
-
-    def gen_rpawn_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        id = chess[i][j]
-        y, x = i - 1, j
-        if y > 0 and not self.same(id, chess[y][x]):
-            self.add_move(j, i, x, y, ply)
-        if i < 5:  # 是否已过河
-            y, x = i, j + 1
-            if x < 9 and not self.same(id, chess[y][x]):
-                self.add_move(j, i, x, y, ply)
-            x = j - 1
-            if x >= 0 and self.same(id, chess[y][x]):
-                self.add_move(j, i, x, y, ply)
-
-    def gen_bpawn_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        # 产生黑兵的合法走法
-        id = chess[i][j]
-        y, x = i + 1, j
-        if y < 10 and not self.same(id, chess[y][x]):
-            self.add_move(j, i, x, y, ply)
-        if i > 4:
-            y, x = i, j + 1
-            if x < 9 and not self.same(id, chess[y][x]):
-                self.add_move(j, i, x, y, ply)
-            x = j - 1
-            if x >= 0 and not self.same(id, chess[y][x]):
-                self.add_move(j, i, x, y, ply)
-
-    def gen_car_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        id = chess[i][j]
-        x, y = j + 1, i
-        # 纵
-        while x < 9:
-            if chess[y][x] == Chessman.NOCHESS:
-                self.add_move(j, i, x, y, ply)
-            else:
-                if not self.same(id, chess[y][x]):
-                    self.add_move(j, i, x, y, ply)
-                    break
-            x += 1
-        x, y = j - 1, i
-        while x >= 0:
-            if chess[y][x] == Chessman.NOCHESS:
-                self.add_move(j, i, x, y, ply)
-            else:
-                if not self.same(id, chess[y][x]):
-                    self.add_move(j, i, x, y, ply)
-                    break
-            x -= 1
-        # 横
-        x, y = j, i + 1
-        while y < 10:
-            if chess[y][x] == Chessman.NOCHESS:
-                self.add_move(j, i, x, y, ply)
-            else:
-                if not self.same(id, chess[y][x]):
-                    self.add_move(j, i, x, y, ply)
-                    break
-            y += 1
-        x, y = j, i - 1
-        while y >= 0:
-            if chess[y][x] == Chessman.NOCHESS:
-                self.add_move(j, i, x, y, ply)
-            else:
-                if not self.same(id, chess[y][x]):
-                    self.add_move(j, i, x, y, ply)
-                    break
-            y -= 1
-
-    def gen_cannon_move(self, chess: List[List[int]], i: int, j: int, ply: int):
-        id = chess[i][j]
-        x, y = j + 1, i
-        flag = False
-        # 右
-        while x < 9:
-            if chess[y][x] == Chessman.NOCHESS:
-                if not flag:
-                    self.add_move(j, i, x, y, ply)
-            else:
-                if not flag:
-                    flag = True  # 遇到炮架
-                else:
-                    if not self.same(id, chess[y][x]):
-                        self.add_move(j, i, x, y, ply)
-                        break
-            x += 1
-        # 左
-        x = j - 1
-        flag = False
-        while x >= 0:
-            if chess[y][x] == Chessman.NOCHESS:
-                if not flag:
-                    self.add_move(j, i, x, y, ply)
-            else:
-                if not flag:
-                    flag = True
-                else:
-                    if not self.same(id, chess[y][x]):
-                        self.add_move(j, i, x, y, ply)
-                        break
-            x -= 1
-        # 上
-        x, y = j, i - 1
-        flag = False
-        while y >= 0:
-            if chess[y][x] == Chessman.NOCHESS:
-                if not flag:
-                    self.add_move(j, i, x, y, ply)
-            else:
-                if not flag:
-                    flag = True
-                else:
-                    if not self.same(id, chess[y][x]):
-                        self.add_move(j, i, x, y, ply)
-                        break
-            y -= 1
-        # 下
-        x, y = j, i + 1
-        flag = False
-        while y < 10:
-            if chess[y][x] == Chessman.NOCHESS:
-                if not flag:
-                    self.add_move(j, i, x, y, ply)
-            else:
-                if not flag:
-                    flag = True
-                else:
-                    if not self.same(id, chess[y][x]):
-                        self.add_move(j, i, x, y, ply)
-                        break
-            y += 1
+        if ply >= len(self.killers):
+            self.killers.extend([0, 0] for _ in range(len(self.killers)))
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
 
+    def staged_moves(self, pos: 'SearchEngine', ply: int, side: int, hash_move: int = 0) -> Iterator[int]:
+        '''
+        分阶段按需产生走法: 置换表走法, 按MVV-LVA排好序的吃子走法, 杀手走法, 最后才是其余不吃子的走法.
+        搜索在前面的走法上截断时, 后面的阶段根本不会执行.
+        每一阶段的走法接在第ply层已有走法的后面写入走法栈, 更深的层从新的栈顶开始, 不会覆盖还没走完的走法
+        :param pos:
+        :param ply: 距离根节点的层数
+        :param side: 走棋的一方
+        :param hash_move: 置换表中记录的最佳走法, 0表示没有
+        :return: 逐个产生move_code编码的走法
+        '''
+        chess = pos.chess
+        # 1. 置换表走法, 这时这一层还没有产生走法, 先把这一层标记为空, 下一层才会从这一层的起点开始写入,
+        # 不会用到上一次留下的ply_start[ply + 1]而覆盖前面各层还没走完的走法
+        self.begin_ply(ply)
+        self.end_ply(ply)
+        if hash_move and self.is_pseudo_legal(pos, hash_move, side):
+            yield hash_move
+        else:
+            hash_move = 0
+        # 2. 吃子走法
+        begin = self.ply_start[ply]
+        end = begin + self.gen_captures(pos, ply, side)
+        self.sort_captures(pos, begin, end)
+        for i in range(begin, end):
+            move = self.moves[i]
+            if move != hash_move:
+                yield move
+        # 3. 杀手走法, 只能是当前局面下可以走的不吃子走法
+        killers = self.killers[ply] if ply < len(self.killers) else (0, 0)
+        tried = [hash_move]
+        for move in tuple(killers):
+            if move and move not in tried and chess[move & 255] == Chessman.NOCHESS \
+                    and self.is_pseudo_legal(pos, move, side):
+                tried.append(move)
+                yield move
+        # 4. 其余不吃子的走法
+        begin = self.ply_start[ply + 1]
+        end = self.ply_start[ply] + self.gen_quiets(pos, ply, side, True)
+        for i in range(begin, end):
+            move = self.moves[i]
+            if move not in tried:
+                yield move
 
-class Evaluation:
-    '''
-    估值函数
-    '''
+    def create_legal_move(self, pos: 'SearchEngine', ply: int, side: int) -> int:
+        '''
+        产生一层的合法走法: 先产生全部可能的走法, 再去掉走完以后己方将帅被攻击或者将帅照面的走法.
+        没有被将军时, 只有走动将帅、离开将帅所在行列或斜向相邻位置(对方马腿)、走到将帅所在行列(炮架)的走法
+        才可能送将, 其余走法不用试走
+        :param pos: 当前局面, 需要提供make_move/un_make_move/in_check
+        :param ply: 距离根节点的层数
+        :param side: 是否是红子
+        :return: 走法数量
+        '''
+        cnt = self.create_possible_move(pos, ply, side)
+        king = pos.kings[side]
+        if not king:
+            return cnt
+        checked = pos.in_check(side)
+        rank, file = king >> 4, king & 15
+        moves = self.moves
+        begin = self.ply_start[ply]
+        end = begin
+        for i in range(begin, begin + cnt):
+            move = moves[i]
+            fron, to = move >> 8, move & 255
+            if checked or fron == king or fron >> 4 == rank or fron & 15 == file \
+                    or to >> 4 == rank or to & 15 == file or fron - king in ADVISOR_DELTAS:
+                chess_id = pos.make_move(move)
+                illegal = pos.in_check(side)
+                pos.un_make_move(move, chess_id)
+                if illegal:
+                    continue
+            moves[end] = move
+            end += 1
+        self.move_cnt = end
+        return self.end_ply(ply)
 
-    def __init__(self) -> None:
-        self.base_value = [0] * 15  # 棋子基本价值
-        self.flex_value = [0] * 15  # 存放棋子灵活性分数的数组
-        self.attack_pos = [[0] * 9 for _ in range(10)]  # 每一个位置被威胁的信息
-        self.guard_pos = [[0] * 9 for _ in range(10)]  # 每一位置被保护的信息
-        self.flexibility_pos = [[0] * 9 for _ in range(10)]  # 每一位置的棋子的灵活性分数
-        self.chess_value = [[0] * 9 for _ in range(10)]  # 每一位置上的棋子的总价值
+    def is_attacked(self, pos: 'SearchEngine', sq: int, side: int) -> bool:
+        '''
+        判断位置sq是否被side一方攻击, 从sq出发反查可能攻击它的棋子, 不需要产生对方的全部走法
+        :param pos:
+        :param sq:
+        :param side: 攻击方
+        :return:
+        '''
+        chess = pos.chess
+        base = 0 if side == 0 else Chessman.R_KING - Chessman.B_KING  # 红子的编号比同类黑子大7
+        car, cannon, king = Chessman.B_CAR + base, Chessman.B_CANNON + base, Chessman.B_KING + base
+        facing = chess[sq] + king == 9  # sq上是对方的将帅
+        # 车: 从sq出发车能吃到的位置上是对方的车; sq上是将帅时, 对方的将帅出现在同一列上就是照面
+        rank = RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+        file = FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+        for delta in rank[1]:
+            if chess[sq + delta] == car:
+                return True
+        for delta in file[1]:
+            id = chess[sq + delta]
+            if id == car or facing and id == king:
+                return True
+        # 炮: 从sq出发炮能吃到的位置上是对方的炮
+        for delta in rank[2]:
+            if chess[sq + delta] == cannon:
+                return True
+        for delta in file[2]:
+            if chess[sq + delta] == cannon:
+                return True
+        horse = Chessman.B_HORSE + base
+        for fron, leg in HORSE_ATTACKERS[sq]:
+            if chess[fron] == horse and chess[leg] == Chessman.NOCHESS:
+                return True
+        pawn = Chessman.B_PAWN + base
+        for fron in PAWN_ATTACKERS[side][sq]:
+            if chess[fron] == pawn:
+                return True
+        for fron in KING_MOVES[side][sq]:
+            if chess[fron] == king:
+                return True
+        advisor = Chessman.B_BISHOP + base
+        for fron in ADVISOR_MOVES[side][sq]:
+            if chess[fron] == advisor:
+                return True
+        elephant = Chessman.B_ELEPHANT + base
+        for fron, eye in ELEPHANT_MOVES[side][sq]:
+            if chess[fron] == elephant and chess[eye] == Chessman.NOCHESS:
+                return True
+        return False
+
+    def gen_king_move(self, pos: 'SearchEngine', sq: int):
+        '''
+        产生国王的走法
+        :param pos:
+        :param sq: 棋子所在位置
+        :return:
+        '''
+        chess = pos.chess
+        id = chess[sq]
+        side = PIECE_SIDE[id]
+        targets = self.targets
+        for to in KING_MOVES[side][sq]:
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+        # 将帅照面时可以直接吃掉对方的将帅
+        if targets[side ^ 1] and pos.kings_facing():
+            self.add_move(sq, pos.kings[side ^ 1])
+
+    def gen_rbishop_move(self, chess: bytearray, sq: int):
+        targets = self.targets
+        for to in ADVISOR_MOVES[1][sq]:
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_bbishop_move(self, chess: bytearray, sq: int):
+        targets = self.targets
+        for to in ADVISOR_MOVES[0][sq]:
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_elephant_move(self, chess: bytearray, sq: int):
+        side = PIECE_SIDE[chess[sq]]
+        targets = self.targets
+        for to, eye in ELEPHANT_MOVES[side][sq]:
+            if chess[eye] == Chessman.NOCHESS and targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_horse_move(self, chess: bytearray, sq: int):
+        targets = self.targets
+        for to, leg in HORSE_MOVES[sq]:
+            if chess[leg] == Chessman.NOCHESS and targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_rpawn_move(self, chess: bytearray, sq: int):
+        # 哨兵的PIECE_SIDE为3, 在targets中总是False, 出界的走法自然被排除
+        targets = self.targets
+        to = sq - 16
+        if targets[PIECE_SIDE[chess[to]]]:
+            self.add_move(sq, to)
+        if rank_of(sq) < 5:  # 是否已过河
+            to = sq + 1
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+            to = sq - 1
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_bpawn_move(self, chess: bytearray, sq: int):
+        # 产生黑兵的合法走法
+        targets = self.targets
+        to = sq + 16
+        if targets[PIECE_SIDE[chess[to]]]:
+            self.add_move(sq, to)
+        if rank_of(sq) > 4:
+            to = sq + 1
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+            to = sq - 1
+            if targets[PIECE_SIDE[chess[to]]]:
+                self.add_move(sq, to)
+
+    def gen_car_move(self, pos: 'SearchEngine', sq: int):
+        chess = pos.chess
+        targets = self.targets
+        # 按所在行、列的占用位图查表, 一次得到车在横竖两个方向上的全部走法
+        rank = RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+        file = FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+        if targets[2]:
+            for delta in rank[0]:
+                self.add_move(sq, sq + delta)
+            for delta in file[0]:
+                self.add_move(sq, sq + delta)
+        for delta in rank[1]:
+            if targets[PIECE_SIDE[chess[sq + delta]]]:
+                self.add_move(sq, sq + delta)
+        for delta in file[1]:
+            if targets[PIECE_SIDE[chess[sq + delta]]]:
+                self.add_move(sq, sq + delta)
+
+    def gen_cannon_move(self, pos: 'SearchEngine', sq: int):
+        chess = pos.chess
+        targets = self.targets
+        # 炮不吃子时走法和车一样, 吃子时查炮架后面的第一个棋子
+        rank = RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+        file = FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+        if targets[2]:
+            for delta in rank[0]:
+                self.add_move(sq, sq + delta)
+            for delta in file[0]:
+                self.add_move(sq, sq + delta)
+        for delta in rank[2]:
+            if targets[PIECE_SIDE[chess[sq + delta]]]:
+                self.add_move(sq, sq + delta)
+        for delta in file[2]:
+            if targets[PIECE_SIDE[chess[sq + delta]]]:
+                self.add_move(sq, sq + delta)
+
+
+class Evaluation:
+    '''
+    估值函数
+    '''
+
+    def __init__(self) -> None:
+        self.base_value = [0] * 15  # 棋子基本价值
+        self.flex_value = [0] * 15  # 存放棋子灵活性分数的数组
+        self.attack_pos = [0] * BOARD_SIZE  # 每一个位置被威胁的信息
+        self.guard_pos = [0] * BOARD_SIZE  # 每一位置被保护的信息
+        self.flexibility_pos = [0] * BOARD_SIZE  # 每一位置的棋子的灵活性分数
+        self.chess_value = [0] * BOARD_SIZE  # 每一位置上的棋子的总价值
         self.pos_cnt = 0  # 记录一棋子的相关位置个数
-        self.relate_pos = [ChessmanPosition()] * 20  # 记录一个棋子相关位置的数组
+        self.relate_pos = [0] * 20  # 记录一个棋子相关位置的数组
         # 红卒的附加值矩阵
-        self.BA0 = [
+        self.BA0 = board_values([
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
             [90, 90, 110, 120, 120, 120, 110, 90, 90],
             [90, 90, 110, 120, 120, 120, 110, 90, 90],
@@ -515,9 +1147,9 @@ class Evaluation:
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
             [0, 0, 0, 0, 0, 0, 0, 0, 0]
-        ]
+        ])
         # 黑兵的附加值矩阵
-        self.BA1 = [
+        self.BA1 = board_values([
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
             [0, 0, 0, 0, 0, 0, 0, 0, 0],
@@ -528,7 +1160,7 @@ class Evaluation:
             [90, 90, 110, 120, 120, 120, 110, 90, 90],
             [90, 90, 110, 120, 120, 120, 110, 90, 90],
             [0, 0, 0, 0, 0, 0, 0, 0, 0]
-        ]
+        ])
         # 定义每一种棋子的基本价值
         self.BASEVALUE_PAWN = 100
         self.BASEVALUE_BISHOP = 250
@@ -581,21 +1213,21 @@ class Evaluation:
         self.flex_value[Chessman.R_CANNON] = self.FLEXIBILITY_CANNON
         self.flex_value[Chessman.R_PAWN] = self.FLEXIBILITY_PAWN
 
-    def reset(self):
-        for i in range(10):
-            for j in range(9):
-                self.attack_pos[i][j] = 0
-                self.guard_pos[i][j] = 0
-                self.flexibility_pos[i][j] = 0
-                self.chess_value[i][j] = 0
+    def reset(self, squares: List[int]):
+        # 中间状态只会写到有棋子的位置上, 所以只需要清空这些位置
+        for sq in squares:
+            self.attack_pos[sq] = 0
+            self.guard_pos[sq] = 0
+            self.flexibility_pos[sq] = 0
+            self.chess_value[sq] = 0
 
-    def get_bing_value(self, x, y, chess):
+    def get_bing_value(self, sq, chess):
         # 如果是红兵返回其位置附加价值
-        if chess[y][x] == Chessman.R_PAWN:
-            return self.BA0[y][x]
+        if chess[sq] == Chessman.R_PAWN:
+            return self.BA0[sq]
         # 如果是黑兵返回其位置附加价值
-        if chess[y][x] == Chessman.B_PAWN:
-            return self.BA1[y][x]
+        if chess[sq] == Chessman.B_PAWN:
+            return self.BA1[sq]
         return 0
 
     def same(self, chess1, chess2):
@@ -614,434 +1246,211 @@ class Evaluation:
     def is_black(self, id):
         return 1 <= id <= 7
 
-    def evaluate(self, chess: List[List[int]], is_red: bool) -> int:
+    def evaluate(self, pos: 'SearchEngine', is_red: bool) -> int:
         '''
         棋子评估函数, 判断三种情况, 灵活性(当前元素可以活动的范围), 被保护的值(当前元素被自己人保护), 被攻击(当前元素被敌方攻击)
-        :param chess: 棋盘
+        :param pos: 当前局面, 提供一维棋盘chess以及双方的棋子列表pieces
         :param is_red: 是否轮到红子
         :return:
         '''
         # 每调一次估值函数就统计一次(只有叶子节点才会调估值函数)
         self.leaf_cnt += 1
-        self.reset()  # 重置中间状态值
+        if pos.track_attacks:
+            return self.evaluate_maps(pos, is_red)
+        chess = pos.chess
+        squares = pos.pieces[0] + pos.pieces[1]  # 棋盘上所有棋子的位置
+        self.reset(squares)  # 重置中间状态值
         chess_type, target_type = None, None
-        for i in range(10):
-            for j in range(9):
-                if chess[i][j] != Chessman.NOCHESS:
-                    chess_type = chess[i][j]  # 获取棋子类型
-                    self.get_relate_piece(chess, j, i)  # 找出该棋子所有相关位置
-                    for k in range(self.pos_cnt):
-                        target_type = chess[self.relate_pos[k].y][self.relate_pos[k].x]
-                        # 如果当前元素有一个空位可以走, 则灵活性加1
-                        if target_type == Chessman.NOCHESS:
-                            self.flexibility_pos[i][j] += 1
+        for sq in squares:
+            chess_type = chess[sq]  # 获取棋子类型
+            self.get_relate_piece(pos, sq)  # 找出该棋子所有相关位置
+            for k in range(self.pos_cnt):
+                target = self.relate_pos[k]
+                target_type = chess[target]
+                # 如果当前元素有一个空位可以走, 则灵活性加1
+                if target_type == Chessman.NOCHESS:
+                    self.flexibility_pos[sq] += 1
+                else:
+                    if self.same(chess_type, target_type):  # 如果是己方棋子, 则保护
+                        self.guard_pos[target] += 1
+                    else:  # 敌方棋子, 开始威胁
+                        self.attack_pos[target] += 1
+                        self.flexibility_pos[sq] += 1  # 灵活性增加
+                        # 判断当前是否攻击到了对方的将军, 如果攻击到了对方的将军则直接就可以结束
+                        if target_type == Chessman.R_KING:
+                            if not is_red:
+                                return 18888
+                        elif target_type == Chessman.B_KING:
+                            if is_red:
+                                return 18888
                         else:
-                            if self.same(chess_type, target_type):  # 如果是己方棋子, 则保护
-                                self.guard_pos[self.relate_pos[k].y][self.relate_pos[k].x] += 1
-                            else:  # 敌方棋子, 开始威胁
-                                self.attack_pos[self.relate_pos[k].y][self.relate_pos[k].x] += 1
-                                self.flexibility_pos[i][j] += 1  # 灵活性增加
-                                # 判断当前是否攻击到了对方的将军, 如果攻击到了对方的将军则直接就可以结束
-                                if target_type == Chessman.R_KING:
-                                    if not is_red:
-                                        return 18888
-                                elif target_type == Chessman.B_KING:
-                                    if is_red:
-                                        return 18888
-                                else:
-                                    self.attack_pos[self.relate_pos[k].y][self.relate_pos[k].x] \
-                                        += (30 + (
-                                            self.base_value[target_type] - self.base_value[chess_type]) // 10) // 10
+                            self.attack_pos[target] \
+                                += (30 + (
+                                    self.base_value[target_type] - self.base_value[chess_type]) // 10) // 10
         # 计算灵活性带来的价值
-        for i in range(10):
-            for j in range(9):
-                if chess[i][j] != Chessman.NOCHESS:
-                    chess_type = chess[i][j]
-                    self.chess_value[i][j] += 1
-                    self.chess_value[i][j] += self.flex_value[chess_type] * self.flexibility_pos[i][j]
-                    self.chess_value[i][j] += self.get_bing_value(j, i, chess)
+        for sq in squares:
+            chess_type = chess[sq]
+            self.chess_value[sq] += 1
+            self.chess_value[sq] += self.flex_value[chess_type] * self.flexibility_pos[sq]
+            self.chess_value[sq] += self.get_bing_value(sq, chess)
         # 统计被攻击的棋子所损失的价值
         half_value = 0
-        for i in range(10):
-            for j in range(9):
-                if chess[i][j] != Chessman.NOCHESS:
-                    chess_type = chess[i][j]
-                    half_value = self.base_value[chess_type] // 16
-                    self.chess_value[i][j] += self.base_value[chess_type]
-                    if self.is_red(chess_type):
-                        if self.attack_pos[i][j]:  # 如果当前红棋被威胁
-                            if is_red:  # 当前轮到红方下子
-                                if chess_type == Chessman.R_KING:
-                                    self.chess_value[i][j] -= 20
-                                else:
-                                    self.chess_value[i][j] -= half_value * 2
-                                    if self.guard_pos[i][j]:
-                                        self.chess_value[i][j] += half_value
-                            else:
-                                if chess_type == Chessman.R_KING:
-                                    return 18888
-                                self.chess_value[i][j] -= half_value * 10
-                                if self.guard_pos[i][j]:
-                                    self.chess_value[i][j] += half_value * 9
-                            self.chess_value[i][j] -= self.attack_pos[i][j]
-                        else:  # 没受威胁
-                            if self.guard_pos[i][j]:
-                                self.chess_value[i][j] += 5
+        for sq in squares:
+            chess_type = chess[sq]
+            half_value = self.base_value[chess_type] // 16
+            self.chess_value[sq] += self.base_value[chess_type]
+            if self.is_red(chess_type):
+                if self.attack_pos[sq]:  # 如果当前红棋被威胁
+                    if is_red:  # 当前轮到红方下子
+                        if chess_type == Chessman.R_KING:
+                            self.chess_value[sq] -= 20
+                        else:
+                            self.chess_value[sq] -= half_value * 2
+                            if self.guard_pos[sq]:
+                                self.chess_value[sq] += half_value
                     else:
-                        if self.attack_pos[i][j]:
-                            if not is_red:
-                                if chess_type == Chessman.B_KING:
-                                    self.chess_value[i][j] -= 20
-                                else:
-                                    self.chess_value[i][j] -= half_value * 2
-                                    if self.guard_pos[i][j]:
-                                        self.chess_value[i][j] += half_value
-                            else:
-                                if chess_type == Chessman.B_KING:
-                                    return 18888
-                                self.chess_value[i][j] -= half_value * 10
-                                if self.guard_pos[i][j]:
-                                    self.chess_value[i][j] += half_value * 9
-                            self.chess_value[i][j] -= self.attack_pos[i][j]
+                        if chess_type == Chessman.R_KING:
+                            return 18888
+                        self.chess_value[sq] -= half_value * 10
+                        if self.guard_pos[sq]:
+                            self.chess_value[sq] += half_value * 9
+                    self.chess_value[sq] -= self.attack_pos[sq]
+                else:  # 没受威胁
+                    if self.guard_pos[sq]:
+                        self.chess_value[sq] += 5
+            else:
+                if self.attack_pos[sq]:
+                    if not is_red:
+                        if chess_type == Chessman.B_KING:
+                            self.chess_value[sq] -= 20
                         else:
-                            if self.guard_pos[i][j]:
-                                self.chess_value[i][j] += 5
+                            self.chess_value[sq] -= half_value * 2
+                            if self.guard_pos[sq]:
+                                self.chess_value[sq] += half_value
+                    else:
+                        if chess_type == Chessman.B_KING:
+                            return 18888
+                        self.chess_value[sq] -= half_value * 10
+                        if self.guard_pos[sq]:
+                            self.chess_value[sq] += half_value * 9
+                    self.chess_value[sq] -= self.attack_pos[sq]
+                else:
+                    if self.guard_pos[sq]:
+                        self.chess_value[sq] += 5
         # 开始统计每一个棋子的总价值
         red_value, black_value = 0, 0
-        for i in range(10):
-            for j in range(9):
-                chess_type = chess[i][j]
-                if chess_type != Chessman.NOCHESS:
-                    if self.is_red(chess_type):
-                        red_value += self.chess_value[i][j]
-                    else:
-                        black_value += self.chess_value[i][j]
+        for sq in pos.pieces[1]:
+            red_value += self.chess_value[sq]
+        for sq in pos.pieces[0]:
+            black_value += self.chess_value[sq]
         if is_red:
             return red_value - black_value
         return black_value - red_value
 
-    def add_point(self, x, y):
-        self.relate_pos[self.pos_cnt].x = x
-        self.relate_pos[self.pos_cnt].y = y
-        self.pos_cnt += 1
+    def evaluate_maps(self, pos: 'SearchEngine', is_red: bool) -> int:
+        '''
+        与evaluate的结果相同, 但直接读取搜索引擎增量维护的相关位置和攻击图, 不再逐个棋子找相关位置.
+        一个棋子被攻击的分数是 sum((300 + 被攻击棋子价值 - 攻击者价值) // 100), 基本价值都是50的倍数,
+        所以只需要知道攻击者的个数、价值之和以及其中价值不是100整数倍的个数就能算出来
+        :param pos:
+        :param is_red: 是否轮到红子
+        :return:
+        '''
+        chess = pos.chess
+        side = 1 if is_red else 0
+        # 轮到走棋的一方已经可以吃掉对方的将帅
+        king = pos.kings[side ^ 1]
+        if king and pos.control[side][king] & 255:
+            return 18888
+        relates = pos.relates
+        values = [0, 0]
+        for s in (0, 1):
+            own, enemy = pos.control[s], pos.control[s ^ 1]
+            total = 0
+            for sq in pos.pieces[s]:
+                chess_type = chess[sq]
+                flexibility = 0
+                for target in relates[sq]:
+                    if PIECE_SIDE[chess[target]] != s:
+                        flexibility += 1
+                base = self.base_value[chess_type]
+                value = 1 + self.flex_value[chess_type] * flexibility + self.get_bing_value(sq, chess) + base
+                attack = enemy[sq]
+                if attack:
+                    count, half_cnt = attack & 255, attack >> 8 & 255
+                    if chess_type == Chessman.R_KING or chess_type == Chessman.B_KING:
+                        attack = count
+                    else:
+                        attack = count + (count * (300 + base) - (attack >> 16)
+                                          - 50 * (count - half_cnt if base % 100 else half_cnt)) // 100
+                # 与evaluate一致, 攻击分数正好抵消为0时当作没有被攻击
+                if attack:
+                    half_value = base // 16
+                    if chess_type == Chessman.R_KING or chess_type == Chessman.B_KING:
+                        value -= 20  # 对方的将帅被攻击已经在前面返回了, 这里一定是轮到己方走
+                    elif s == side:
+                        value -= half_value * 2
+                        if own[sq]:
+                            value += half_value
+                    else:
+                        value -= half_value * 10
+                        if own[sq]:
+                            value += half_value * 9
+                    value -= attack
+                elif own[sq]:
+                    value += 5
+                total += value
+            values[s] = total
+        return values[side] - values[side ^ 1]
 
-    def get_relate_piece(self, chess: List[List[int]], j: int, i: int):
-        self.pos_cnt = 0
-        id = chess[i][j]
+    def get_relate_piece(self, pos: 'SearchEngine', sq: int):
+        '''
+        找出一个棋子的所有相关位置(能走到的空位, 以及能攻击或保护到的棋子), 结果放在relate_pos中
+        :param pos: 当前局面
+        :param sq: 棋子所在位置
+        :return: 相关位置的个数
+        '''
+        chess = pos.chess
+        id = chess[sq]
         if id == Chessman.R_KING or id == Chessman.B_KING:
-            for y in range(3):
-                for x in range(3, 6):
-                    if self.can_touch(chess, j, i, x, y):
-                        self.add_point(x, y)
-            for y in range(7, 10):
-                for x in range(3, 6):
-                    if self.can_touch(chess, j, i, x, y):
-                        self.add_point(x, y)
-        elif id == Chessman.R_BISHOP:
-            for y in range(7, 10):
-                for x in range(3, 6):
-                    if self.can_touch(chess, j, i, x, y):
-                        self.add_point(x, y)
+            points = list(KING_MOVES[id == Chessman.R_KING][sq])
+            # 将帅照面
+            for delta in FILE_SLIDES[sq][pos.file_occ[sq & 15]][1]:
+                if chess[sq + delta] + id == 9:
+                    points.append(sq + delta)
+        elif id == Chessman.R_BISHOP or id == Chessman.B_BISHOP:
+            points = ADVISOR_MOVES[id == Chessman.R_BISHOP][sq]
         elif id == Chessman.R_ELEPHANT or id == Chessman.B_ELEPHANT:
-            x, y = j + 2, i + 2
-            if x < 9 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j + 2, i - 2
-            if x < 9 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 2, i + 2
-            if x >= 0 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 2, i - 2
-            if x >= 0 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
+            points = [to for to, eye in ELEPHANT_MOVES[id == Chessman.R_ELEPHANT][sq] if chess[eye] == Chessman.NOCHESS]
         elif id == Chessman.R_HORSE or id == Chessman.B_HORSE:
-            x, y = j + 2, i + 1
-            if x < 9 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j + 2, i - 1
-            if x < 9 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 2, i + 1
-            if x >= 0 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 2, i - 1
-            if x >= 0 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j + 1, i + 2
-            if x < 9 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 1, i + 2
-            if x >= 0 and y < 10 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j + 1, i - 2
-            if x < 9 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
-            x, y = j - 1, i - 2
-            if x >= 0 and y >= 0 and self.can_touch(chess, j, i, x, y):
-                self.add_point(x, y)
+            points = [to for to, leg in HORSE_MOVES[sq] if chess[leg] == Chessman.NOCHESS]
         elif id == Chessman.R_CAR or id == Chessman.B_CAR:
-            x, y = j + 1, i
-            while x < 9:
-                if chess[y][x] == Chessman.NOCHESS:
-                    self.add_point(x, y)
-                else:
-                    self.add_point(x, y)
-                x += 1
-            x, y = j - 1, i
-            while x >= 0:
-                if chess[y][x] == Chessman.NOCHESS:
-                    self.add_point(x, y)
-                else:
-                    self.add_point(x, y)
-                    break
-                x -= 1
-            x, y = j, i + 1
-            while y < 10:
-                if chess[y][x] == Chessman.NOCHESS:
-                    self.add_point(x, y)
-                else:
-                    self.add_point(x, y)
-                    break
-                y += 1
-            x, y = j, i - 1
-            while y >= 0:
-                if chess[y][x] == Chessman.NOCHESS:
-                    self.add_point(x, y)
-                else:
-                    self.add_point(x, y)
-                    break
-                y -= 1
-        elif id == Chessman.R_PAWN:
-            y, x = i - 1, j
-            if y >= 0:
-                self.add_point(x, y)
-            if i < 5:
-                y, x = i, j + 1
-                if x < 9:
-                    self.add_point(x, y)
-                x = j - 1
-                if x >= 0:
-                    self.add_point(x, y)
-        elif id == Chessman.B_PAWN:
-            y, x = i + 1, j
-            if y < 10:
-                self.add_point(x, y)
-            if i > 4:
-                y, x = i, j + 1
-                if x < 9:
-                    self.add_point(x, y)
-                x = j - 1
-                if x >= 0:
-                    self.add_point(x, y)
+            # 车能走到的空位以及横竖方向上遇到的第一个棋子
+            rank = RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+            file = FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+            points = [sq + delta for delta in rank[0] + rank[1] + file[0] + file[1]]
+        elif id == Chessman.R_PAWN or id == Chessman.B_PAWN:
+            points = PAWN_MOVES[id == Chessman.R_PAWN][sq]
         elif id == Chessman.B_CANNON or id == Chessman.R_CANNON:
-            x, y = j + 1, i
-            flag = False
-            while x < 9:
-                if chess[y][x] == Chessman.NOCHESS:
-                    if not flag:
-                        self.add_point(x, y)
-                else:
-                    if not flag:
-                        flag = True
-                    else:
-                        self.add_point(x, y)
-                        break
-                x += 1
-            x = j - 1
-            flag = False
-            while x >= 0:
-                if chess[y][x] == Chessman.NOCHESS:
-                    if not flag:
-                        self.add_point(x, y)
-                else:
-                    if not flag:
-                        flag = True
-                    else:
-                        self.add_point(x, y)
-                        break
-                x -= 1
-            x, y = j, i + 1
-            flag = False
-            while y < 10:
-                if chess[y][x] == Chessman.NOCHESS:
-                    if not flag:
-                        self.add_point(x, y)
-                else:
-                    if not flag:
-                        flag = True
-                    else:
-                        self.add_point(x, y)
-                        break
-                y += 1
-            y = i - 1
-            flag = False
-            while y >= 0:
-                if chess[y][x] == Chessman.NOCHESS:
-                    if not flag:
-                        self.add_point(x, y)
-                else:
-                    if not flag:
-                        flag = True
-                    else:
-                        self.add_point(x, y)
-                        break
-                y -= 1
+            # 炮能走到的空位以及炮架后面的第一个棋子
+            rank = RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+            file = FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+            points = [sq + delta for delta in rank[0] + rank[2] + file[0] + file[2]]
+        else:
+            points = ()
+        self.relate_pos = points
+        self.pos_cnt = len(points)
         return self.pos_cnt
 
-    def can_touch(self, chess: List[List[int]], from_x: int, from_y: int, to_x: int, to_y: int) -> bool:
-        if from_y == to_y and from_x == to_x:
-            return False
-        move_id = chess[from_y][from_x]
-        target_id = chess[to_y][to_x]
-        if move_id == Chessman.B_KING:
-            if target_id == Chessman.R_KING:
-                if from_x != to_x:
-                    return False
-                for i in range(from_y + 1, to_y):
-                    if chess[i][from_x] != Chessman.NOCHESS:
-                        return False
-            else:
-                if to_y > 2 or to_x > 5 or to_x < 3:
-                    return False
-                if abs(from_y - to_y) + abs(to_x - from_x) > 1:
-                    return False
-        elif move_id == Chessman.R_BISHOP:
-            if to_y < 7 or to_x > 5 or to_x < 3:
-                return False
-            if abs(from_y - to_y) != 2 or abs(to_x - from_x) != 1:
-                return False
-        elif move_id == Chessman.B_BISHOP:
-            if to_y > 2 or to_x > 5 or to_x < 3:
-                return False
-            if abs(from_y - to_y) != 1 or abs(to_x - from_x) != 1:
-                return False
-        elif move_id == Chessman.R_ELEPHANT:
-            if to_y < 5:
-                return False
-            if abs(from_x - to_x) != 2 or abs(from_y - to_y) != 2:
-                return False
-            if chess[(from_y + to_y) // 2][(from_x + to_x) // 2] != Chessman.NOCHESS:
-                return False
-        elif move_id == Chessman.B_ELEPHANT:
-            if to_y > 4:
-                return False
-            if abs(from_x - to_x) != 2 or abs(from_y - to_y) != 2:
-                return False
-            if chess[(from_y + to_y) // 2][(from_x + to_x) // 2] != Chessman.NOCHESS:
-                return False
-        elif move_id == Chessman.B_PAWN:
-            if to_y < from_y:
-                return False
-            if from_y < 5 and from_y == to_y:
-                return False
-            if to_y - from_y + abs(to_x - from_x) > 1:
-                return False
-        elif move_id == Chessman.R_PAWN:
-            if to_y > from_y:
-                return False
-            if from_y > 4 and from_y == to_y:
-                return False
-            if from_y - to_y + abs(to_x - from_x) > 1:
-                return False
-        elif move_id == Chessman.R_KING:
-            if target_id == Chessman.B_KING:
-                if from_x != to_x:
-                    return False
-                for i in range(from_y - 1, to_y):
-                    if chess[i][from_x] != Chessman.NOCHESS:
-                        return False
-            else:
-                if to_y < 7 or to_x > 5 or to_x < 3:
-                    return False
-                if abs(from_y - to_y) + abs(to_x - from_x) > 1:
-                    return False
-        elif move_id == Chessman.B_CAR or move_id == Chessman.R_CAR:
-            if from_y != to_y and from_x != to_x:
-                return False
-            if from_y == to_y:
-                if from_x < to_x:
-                    for i in range(from_x + 1, to_x):
-                        if chess[from_y][i] != Chessman.NOCHESS:
-                            return False
-                else:
-                    for i in range(to_x + 1, from_x):
-                        if chess[from_y][i] != Chessman.NOCHESS:
-                            return False
-            else:
-                if from_y < to_y:
-                    for j in range(from_y + 1, to_y):
-                        if chess[j][from_x] != Chessman.NOCHESS:
-                            return False
-                else:
-                    for j in range(to_y + 1, from_y):
-                        if chess[j][from_x] != Chessman.NOCHESS:
-                            return False
-        elif move_id == Chessman.B_HORSE or move_id == Chessman.R_HORSE:
-            if not ((abs(to_x - from_x) == 1 and abs(to_y - from_y) == 2)
-                    or (abs(to_x - from_x) == 2 and abs(to_y - from_y) == 1)):
-                return False
-            if to_x - from_x == 2:
-                i, j = from_x + 1, from_y
-            elif from_x - to_x == 2:
-                i, j = from_x - 1, from_y
-            elif to_y - from_y == 2:
-                i, j = from_x, from_y + 1
-            elif from_y - to_y == 2:
-                i, j = from_x, from_y - 1
-            if chess[j][i] != Chessman.NOCHESS:
-                return False
-        elif move_id == Chessman.B_CANNON or move_id == Chessman.R_CANNON:
-            if from_y != to_y and from_x != to_x:
-                return False
-            if chess[to_y][to_x] == Chessman.NOCHESS:
-                if from_y == to_y:
-                    if from_x < to_x:
-                        for i in range(from_x + 1, to_x):
-                            if chess[from_y][i] != Chessman.NOCHESS:
-                                return False
-                    else:
-                        for i in range(to_x + 1, from_x):
-                            if chess[from_y][i] != Chessman.NOCHESS:
-                                return False
-                else:
-                    if from_y < to_y:
-                        for j in range(from_y + 1, to_y):
-                            if chess[j][from_x] != Chessman.NOCHESS:
-                                return False
-                    else:
-                        for j in range(to_y, from_y):
-                            if chess[j][from_x] != Chessman.NOCHESS:
-                                return False
-            else:
-                cnt = 0
-                if from_y == to_y:
-                    if from_x < to_x:
-                        for i in range(from_x + 1, to_x):
-                            if chess[from_y][i] != Chessman.NOCHESS:
-                                cnt += 1
-                            if cnt != 1:
-                                return False
-                    else:
-                        for i in range(to_x + 1, from_x):
-                            if chess[from_y][i] != Chessman.NOCHESS:
-                                cnt += 1
-                            if cnt != 1:
-                                return False
-                else:
-                    if from_y < to_y:
-                        for j in range(from_y + 1, to_y):
-                            if chess[j][from_x] != Chessman.NOCHESS:
-                                cnt += 1
-                            if cnt != 1:
-                                return False
-                    else:
-                        for j in range(to_y + 1, from_y):
-                            if chess[j][from_x] != Chessman.NOCHESS:
-                                cnt += 1
-                            if cnt != 1:
-                                return False
-        return True
+
+NATURAL_LIMIT = 120  # 自然限着: 双方连续60回合(120步)没有吃子判和
+BAN_VALUE = 19700  # 长将判负的分值, 比将死的分值(19990左右)低, 能真正将死对方时优先将死
+# repetition的结果, 胜负是对轮到走棋的一方而言
+REP_NONE = 0  # 没有重复
+REP_DRAW = 1  # 重复局面, 判和
+REP_WIN = 2  # 对方长将, 判对方负
+REP_LOSS = 3  # 己方长将, 判己方负
+REP_VALUE = (0, 0, BAN_VALUE, -BAN_VALUE)  # 各种重复结果的分值
 
 
 class SearchEngine:
@@ -1054,43 +1463,416 @@ class SearchEngine:
         self.evaluation = Evaluation()
         self.search_depth = 0  # 搜索深度
         self.max_depth = 0  # 最大深度
-        self.chess = [[0] * 9 for _ in range(10)]
+        self.chess = new_board()  # 一维棋盘
+        self.pieces = [[], []]  # 双方棋子所在的位置, 下标0为黑方, 1为红方
+        self.piece_index = [0] * BOARD_SIZE  # 每个位置上的棋子在pieces中的下标
+        self.rank_occ = [0] * BOARD_HEIGHT  # 每一行的占用位图, 用一维棋盘的行号(sq >> 4)索引
+        self.file_occ = [0] * BOARD_WIDTH  # 每一列的占用位图, 用一维棋盘的列号(sq & 15)索引
+        self.side = 0  # 轮到哪一方走, 1为红方, 0为黑方
+        self.hash = 0  # 当前局面的Zobrist哈希值, 包含轮到哪一方走
+        self.mirror_hash = 0  # 左右镜像后的局面的哈希值, 与hash一起增量更新
+        # 棋局历史, 由make_move压入、un_make_move弹出: 走这一步之前的哈希值、走法(move << 4 | 被吃的棋子)、
+        # 走这一步之前的quiet. 查重复局面时只需要往回找最近quiet步
+        self.hash_history = []
+        self.move_history = []
+        self.quiet_history = []
+        self.quiet = 0  # 自然着法计数: 最近一次吃子以来走了多少步
+        self.kings = [0, 0]  # 双方将帅所在的位置, 0表示已经被吃掉
+        # 攻击图, 在load之前把track_attacks设为True才会建立, 之后由make_move/un_make_move增量维护
+        self.track_attacks = False
+        self.relates = [()] * BOARD_SIZE  # 每个棋子的相关位置(能走到的空位, 能攻击或保护到的棋子)
+        self.relate_id = bytearray(BOARD_SIZE)  # relates[sq]是哪一个棋子的相关位置
+        # control[side][sq]: side一方与sq相关的棋子的汇总, 按attack_pack打包成一个整数:
+        # 低8位是棋子个数, 8~15位是其中基本价值不是100整数倍的个数, 16位以上是这些棋子基本价值之和
+        self.control = [[0] * BOARD_SIZE, [0] * BOARD_SIZE]
+        self.attack_undo = []  # 每走一步记下被重新计算的棋子原来的相关位置, 撤销时直接恢复
+        base_value = self.evaluation.base_value
+        self.attack_pack = [1 + ((base_value[id] % 100 != 0) << 8) + (base_value[id] << 16) if id else 0
+                            for id in range(Chessman.OUT)]
+
+    def load(self, chess: List[List[int]], side: int = 0, history: List[List[int]] = None):
+        '''
+        载入界面传入的10 \times 9棋盘, 同时建立双方的棋子列表.
+        给出history时chess是对局开始时的棋盘, 再用make_move依次走一遍已经走过的棋,
+        这样哈希历史和自然着法计数就包括了对局中的步数, 重复局面和自然限着才能判断对
+        :param chess:
+        :param side: chess局面下轮到哪一方走, 1为红方, 0为黑方
+        :param history: 从chess开始已经走过的棋, 每一步是与chess坐标一致的[old_i, old_j, i, j]
+        :return:
+        '''
+        self.load_board(board_from_list(chess), side)
+        for old_i, old_j, i, j in history or ():
+            self.make_move(move_code(square(old_i, old_j), square(i, j)))
+
+    def load_fen(self, fen: str):
+        '''
+        载入FEN表示的局面, 直接解析成一维棋盘, 不经过10 \times 9棋盘
+        :param fen:
+        :return:
+        '''
+        self.load_board(*board_from_fen(fen))
+
+    def to_fen(self) -> str:
+        '''
+        当前局面的FEN
+        :return:
+        '''
+        return board_to_fen(self.chess, self.side, self.quiet)
+
+    def load_board(self, board: bytearray, side: int = 0, quiet: int = 0):
+        '''
+        载入一维棋盘, 建立双方的棋子列表、占用位图、哈希值和攻击图
+        :param board: 一维棋盘, 直接作为引擎的棋盘使用, 不会复制
+        :param side: 轮到哪一方走, 1为红方, 0为黑方
+        :param quiet: 自然着法计数, 最近一次吃子以来走了多少步
+        :return:
+        '''
+        self.chess = board
+        self.side = side
+        self.hash = zobrist_hash(self.chess, side)
+        self.mirror_hash = zobrist_hash(self.chess, side, ZOBRIST_MIRROR)
+        self.hash_history = []
+        self.move_history = []
+        self.quiet_history = []
+        self.quiet = quiet
+        self.pieces = [[], []]
+        self.rank_occ = [0] * BOARD_HEIGHT
+        self.file_occ = [0] * BOARD_WIDTH
+        self.kings = [0, 0]
+        for sq in SQUARES:
+            id = self.chess[sq]
+            if id != Chessman.NOCHESS:
+                pieces = self.pieces[id >= Chessman.R_KING]
+                self.piece_index[sq] = len(pieces)
+                pieces.append(sq)
+                self.rank_occ[sq >> 4] |= RANK_BIT[sq]
+                self.file_occ[sq & 15] |= FILE_BIT[sq]
+                if id == Chessman.B_KING or id == Chessman.R_KING:
+                    self.kings[id == Chessman.R_KING] = sq
+        self.relates = [()] * BOARD_SIZE
+        self.control = [[0] * BOARD_SIZE, [0] * BOARD_SIZE]
+        self.attack_undo = []
+        if self.track_attacks:
+            for sq in self.pieces[0] + self.pieces[1]:
+                self.calc_relates(sq)
+
+    def set_relates(self, sq: int, relates: tuple, id: int):
+        '''
+        把sq上记录的相关位置换成relates, 先从攻击图中减去旧的, 再加上新的
+        :param sq:
+        :param relates: 新的相关位置
+        :param id: relates属于哪一个棋子
+        :return:
+        '''
+        old = self.relates[sq]
+        if old:
+            old_id = self.relate_id[sq]
+            control, pack = self.control[PIECE_SIDE[old_id]], self.attack_pack[old_id]
+            for target in old:
+                control[target] -= pack
+        if relates:
+            control, pack = self.control[PIECE_SIDE[id]], self.attack_pack[id]
+            for target in relates:
+                control[target] += pack
+        self.relates[sq] = relates
+        self.relate_id[sq] = id
+
+    def calc_relates(self, sq: int):
+        '''
+        重新计算sq上棋子的相关位置
+        :param sq:
+        :return:
+        '''
+        id = self.chess[sq]
+        if id == Chessman.NOCHESS:
+            self.set_relates(sq, (), id)
+        else:
+            evaluation = self.evaluation
+            evaluation.get_relate_piece(self, sq)
+            self.set_relates(sq, tuple(evaluation.relate_pos), id)
+
+    def update_attacks(self, fron: int, to: int):
+        '''
+        走子之后更新攻击图. 只有这些棋子的相关位置会变:
+        走动的棋子和被吃的棋子, fron/to所在行列上的车、炮、将帅, 马腿在fron/to上的马, 象眼在fron/to上的象.
+        原来的相关位置压入attack_undo, 撤销时由restore_attacks恢复
+        :param fron:
+        :param to:
+        :return:
+        '''
+        chess = self.chess
+        dirty = {fron, to}
+        for sq in (fron, to):
+            rank, file = sq >> 4, sq & 15
+            for j in BIT_INDICES[self.rank_occ[rank]]:
+                other = (rank << 4) + j + FILE_LEFT
+                if LINE_PIECE[chess[other]]:
+                    dirty.add(other)
+            for i in BIT_INDICES[self.file_occ[file]]:
+                other = ((i + RANK_TOP) << 4) + file
+                if LINE_PIECE[chess[other]]:
+                    dirty.add(other)
+            for delta in KING_DELTAS:
+                if HORSE_PIECE[chess[sq + delta]]:
+                    dirty.add(sq + delta)
+            for delta in ADVISOR_DELTAS:
+                if ELEPHANT_PIECE[chess[sq + delta]]:
+                    dirty.add(sq + delta)
+        self.attack_undo.append([(sq, self.relates[sq], self.relate_id[sq]) for sq in dirty])
+        for sq in dirty:
+            self.calc_relates(sq)
+
+    def restore_attacks(self):
+        '''
+        撤销一步棋时恢复攻击图
+        :return:
+        '''
+        for sq, relates, id in self.attack_undo.pop():
+            self.set_relates(sq, relates, id)
+
+    def in_check(self, side: Optional[int] = None) -> bool:
+        '''
+        side一方是否被将军(包括将帅照面), 从记录下来的将帅位置反查, 可以用来做将军延伸
+        :param side: 默认为轮到走棋的一方
+        :return:
+        '''
+        if side is None:
+            side = self.side
+        king = self.kings[side]
+        if not king:
+            return False
+        if self.track_attacks:
+            return self.control[side ^ 1][king] & 255 != 0
+        return self.move_generator.is_attacked(self, king, side ^ 1)
+
+    def kings_facing(self) -> bool:
+        '''
+        将帅是否照面: 在同一列上且中间没有棋子
+        :return:
+        '''
+        black, red = self.kings
+        if not black or not red or (black & 15) != (red & 15):
+            return False
+        return red - black in FILE_SLIDES[black][self.file_occ[black & 15]][1]
+
+    def calc_hash(self) -> int:
+        '''
+        从头计算当前局面的哈希值, 用来校验增量更新的self.hash
+        :return:
+        '''
+        return zobrist_hash(self.chess, self.side)
+
+    def canonical_hash(self) -> int:
+        '''
+        左右对称的两个局面共用的键值: hash和mirror_hash中较小的一个.
+        置换表、开局库按这个键值存储时, 局面和它的镜像只占一项; 存取走法时用canonical_move转换
+        :return:
+        '''
+        return min(self.hash, self.mirror_hash)
+
+    def is_mirrored(self) -> bool:
+        '''
+        canonical_hash是否取的是镜像局面的哈希值
+        :return:
+        '''
+        return self.mirror_hash < self.hash
+
+    def canonical_move(self, move: int) -> int:
+        '''
+        在当前局面和canonical_hash代表的局面之间转换走法: 存入时把当前局面的走法转换成标准局面的走法,
+        取出时再转换回来, 镜像是对合的, 两个方向用同一个函数
+        :param move:
+        :return:
+        '''
+        return mirror_move(move) if self.is_mirrored() else move
+
+    def possible_moves(self, side: int) -> List[ChessmanMove]:
+        '''
+        分析接口: 当前局面下side一方所有的走法
+        :param side: 1为红方, 0为黑方
+        :return: 走法记录列表
+        '''
+        generator = self.move_generator
+        cnt = generator.create_possible_move(self, 0, side)
+        return [ChessmanMove.from_code(move, self.chess[move >> 8])
+                for move in generator.moves[:cnt]]
+
+    def perft(self, depth: int, ply: int = 0, table: Optional[Dict[int, int]] = None) -> int:
+        '''
+        统计从当前局面出发走depth步的合法走法序列的个数, 用来校验走法产生器和make_move/un_make_move.
+        最后一层只数走法个数, 不再走下去
+        :param depth: 深度, 至少为1
+        :param ply: 距离根节点的层数, 决定走法写在走法栈的哪一段
+        :param table: (局面哈希值, 深度) -> 节点数的缓存, 不同走法顺序到达的相同局面只统计一次.
+            左右镜像的局面节点数相同, 所以用canonical_hash, 镜像局面也只统计一次
+        :return: 叶子节点数
+        '''
+        if table is not None and depth > 1:
+            key = self.canonical_hash() << 8 | depth
+            nodes = table.get(key)
+            if nodes is not None:
+                return nodes
+        generator = self.move_generator
+        cnt = generator.create_legal_move(self, ply, self.side)
+        if depth <= 1:
+            return cnt
+        nodes = 0
+        begin = generator.ply_start[ply]
+        for i in range(begin, begin + cnt):
+            move = generator.moves[i]
+            chess_id = self.make_move(move)
+            nodes += self.perft(depth - 1, ply + 1, table)
+            self.un_make_move(move, chess_id)
+        if table is not None:
+            table[key] = nodes
+        return nodes
 
-    def make_move(self, move):
-        id = self.chess[move.to.y][move.to.x]
+    def divide(self, depth: int) -> Dict[ChessmanMove, int]:
+        '''
+        分别统计根节点每一个合法走法下面的perft结果, 与其他程序对比时可以找到出错的走法
+        :param depth:
+        :return: 走法 -> 叶子节点数
+        '''
+        generator = self.move_generator
+        cnt = generator.create_legal_move(self, 0, self.side)
+        result = {}
+        for move in generator.moves[:cnt]:
+            chess_id = self.make_move(move)
+            result[ChessmanMove.from_code(move, self.chess[move & 255])] = self.perft(depth - 1, 1) if depth > 1 else 1
+            self.un_make_move(move, chess_id)
+        return result
+
+    def make_move(self, move: int) -> int:
+        '''
+        走一步棋
+        :param move: move_code编码的走法
+        :return: 被吃掉的棋子
+        '''
+        fron, to = move >> 8, move & 255
+        id = self.chess[to]
+        self.hash_history.append(self.hash)
+        self.move_history.append(move << 4 | id)
+        self.quiet_history.append(self.quiet)
+        if id != Chessman.NOCHESS:
+            self.quiet = 0
+            # 从对方的棋子列表中删掉被吃的棋子, 用列表最后一个棋子填补它的空位
+            pieces = self.pieces[id >= Chessman.R_KING]
+            last = pieces.pop()
+            if last != to:
+                idx = self.piece_index[to]
+                pieces[idx] = last
+                self.piece_index[last] = idx
+            if id == Chessman.B_KING or id == Chessman.R_KING:
+                self.kings[id == Chessman.R_KING] = 0
+        else:
+            self.quiet += 1
+            # 目标位置原来是空的, 占用位图上要加上它
+            self.rank_occ[to >> 4] |= RANK_BIT[to]
+            self.file_occ[to & 15] |= FILE_BIT[to]
+        self.rank_occ[fron >> 4] ^= RANK_BIT[fron]
+        self.file_occ[fron & 15] ^= FILE_BIT[fron]
+        # 更新己方棋子列表中的位置
+        idx = self.piece_index[fron]
+        self.pieces[self.chess[fron] >= Chessman.R_KING][idx] = to
+        self.piece_index[to] = idx
+        # 更新哈希值: 移出原位置, 放到目标位置, 去掉被吃的棋子, 交换走棋方
+        moving = self.chess[fron]
+        if moving == Chessman.B_KING or moving == Chessman.R_KING:
+            self.kings[moving == Chessman.R_KING] = to
+        keys = ZOBRIST[moving]
+        self.hash ^= keys[fron] ^ keys[to] ^ ZOBRIST[id][to] ^ ZOBRIST_SIDE
+        keys = ZOBRIST_MIRROR[moving]
+        self.mirror_hash ^= keys[fron] ^ keys[to] ^ ZOBRIST_MIRROR[id][to] ^ ZOBRIST_SIDE
+        self.side ^= 1
         # 移动棋子
-        self.chess[move.to.y][move.to.x] = self.chess[move.fron.y][move.fron.x]
+        self.chess[to] = self.chess[fron]
         # 清空原来的位置
-        self.chess[move.fron.y][move.fron.x] = Chessman.NOCHESS
+        self.chess[fron] = Chessman.NOCHESS
+        if self.track_attacks:
+            self.update_attacks(fron, to)
         return id
 
-    def un_make_move(self, move, chess_id):
+    def un_make_move(self, move: int, chess_id: int):
+        '''
+        撤销一步棋
+        :param move: move_code编码的走法
+        :param chess_id: make_move返回的被吃掉的棋子
+        :return:
+        '''
+        fron, to = move >> 8, move & 255
+        self.hash_history.pop()
+        self.move_history.pop()
+        self.quiet = self.quiet_history.pop()
+        idx = self.piece_index[to]
+        self.pieces[self.chess[to] >= Chessman.R_KING][idx] = fron
+        self.piece_index[fron] = idx
+        moving = self.chess[to]
+        if moving == Chessman.B_KING or moving == Chessman.R_KING:
+            self.kings[moving == Chessman.R_KING] = fron
+        if chess_id == Chessman.B_KING or chess_id == Chessman.R_KING:
+            self.kings[chess_id == Chessman.R_KING] = to
+        keys = ZOBRIST[moving]
+        self.hash ^= keys[fron] ^ keys[to] ^ ZOBRIST[chess_id][to] ^ ZOBRIST_SIDE
+        keys = ZOBRIST_MIRROR[moving]
+        self.mirror_hash ^= keys[fron] ^ keys[to] ^ ZOBRIST_MIRROR[chess_id][to] ^ ZOBRIST_SIDE
+        self.side ^= 1
         # 还原
-        self.chess[move.fron.y][move.fron.x] = self.chess[move.to.y][move.to.x]
-        # 恢复目标位置的棋子
-        self.chess[move.to.y][move.to.x] = chess_id
+        self.chess[fron] = self.chess[to]
+        # 恢复目标位置的棋子, 被吃的棋子重新加入对方的棋子列表
+        self.chess[to] = chess_id
+        if chess_id != Chessman.NOCHESS:
+            pieces = self.pieces[chess_id >= Chessman.R_KING]
+            self.piece_index[to] = len(pieces)
+            pieces.append(to)
+        else:
+            self.rank_occ[to >> 4] ^= RANK_BIT[to]
+            self.file_occ[to & 15] ^= FILE_BIT[to]
+        self.rank_occ[fron >> 4] |= RANK_BIT[fron]
+        self.file_occ[fron & 15] |= FILE_BIT[fron]
+        if self.track_attacks:
+            self.restore_attacks()
+
+    def repetition(self) -> int:
+        '''
+        当前局面是否与历史上的局面重复. 吃子以后不可能回到吃子之前的局面, 所以只在最近quiet步之内,
+        每隔一步(轮到同一方走)比较一次哈希值. 出现重复时倒回这个循环, 看每一步是否都在将军, 判断长将
+        :return: REP_NONE, REP_DRAW, REP_WIN或REP_LOSS
+        '''
+        history = self.hash_history
+        n = len(history)
+        key = self.hash
+        for k in range(n - 2, max(n - self.quiet, 0) - 1, -2):
+            if history[k] == key:
+                break
+        else:
+            return REP_NONE
+        # checks[0]是当前局面, checks[t]是t步之前的局面: t为偶数时轮到己方走, 为奇数时轮到对方走
+        checks = [self.in_check()]
+        undone = []
+        for _ in range(n - k - 1):
+            code = self.move_history[-1]
+            self.un_make_move(code >> 4, code & 15)
+            undone.append(code >> 4)
+            checks.append(self.in_check())
+        for move in reversed(undone):
+            self.make_move(move)
+        they_check = all(checks[0::2])  # 对方每一步都在将军
+        we_check = all(checks[1::2])
+        if they_check and not we_check:
+            return REP_WIN
+        if we_check and not they_check:
+            return REP_LOSS
+        return REP_DRAW
 
     def is_game_over(self, chess, depth):
         '''
-        判断游戏是否已经结束, 将在不在
-        :param position:
+        判断游戏是否已经结束, 将在不在, 直接查看make_move维护的将帅位置
+        :param chess:
         :param depth:
         :return:
         '''
-        red_live, black_live = False, False
-        for i in range(7, 10):
-            for j in range(3, 6):
-                if chess[i][j] == Chessman.B_KING:
-                    black_live = True
-                if chess[i][j] == Chessman.R_KING:
-                    red_live = True
-        for i in range(3):
-            for j in range(3, 6):
-                if chess[i][j] == Chessman.B_KING:
-                    black_live = True
-                if chess[i][j] == Chessman.R_KING:
-                    red_live = True
-        i = (self.max_depth - depth + 1) % 2
+        black_live, red_live = self.kings
+        i = self.side ^ 1  # 刚走完的一方
         if not red_live:
             if i:
                 return 19990 + depth
@@ -1110,45 +1892,675 @@ class NegamaxEngine(SearchEngine):
         super().__init__()
         self.best_move = None
         self.search_depth = search_depth  # 设定搜索深度
+        self.legal = False  # 是否只搜索合法走法, 为True时无棋可走直接判负, 不用多搜一层才发现将帅被吃
 
-    def copy(self, chess1, chess2):
-        for i in range(10):
-            for j in range(9):
-                chess2[i][j] = chess1[i][j]
-
-    def search_a_good_move(self, chess):
+    def search_a_good_move(self, chess, side=0, history=None):
+        '''
+        搜索一步好棋
+        :param chess: 红子在下方的10 \times 9棋盘, 界面上翻转过的棋盘要先用flip_chess转回来
+        :param side: 替哪一方走, 1为红方, 0为黑方
+        :param history: 对局中已经走过的棋, 不为None时chess是开局的棋盘, side是开局时走棋的一方, 见load
+        :return: [old_i, old_j, i, j], 与chess的坐标一致; 没有合法走法(被将死、困毙或者将帅已经被吃)时返回None
+        '''
         # 设定搜索层数
         self.max_depth = self.search_depth
-        # 将传入的棋盘复制到成员变量中
-        self.copy(chess, self.chess)
+        self.best_move = None
+        # 将传入的10 \times 9棋盘转换成一维棋盘, 只在根节点转换一次
+        self.load(chess, side, history)
+        if not self.has_legal_move():
+            return None
         # 调用极大值搜索函数找最佳走法
         self.nega_max(self.max_depth)
-        # 修改棋盘的走法
-        # self.make_move(self.best_move)
-        # 将修改过的棋盘复制到传入的棋盘中
-        self.copy(self.chess, chess)
-        return [self.best_move.fron.y,
-                self.best_move.fron.x,
-                self.best_move.to.y,
-                self.best_move.to.x]
+        return ChessmanMove.from_code(self.best_move).to_list()
+
+    def has_legal_move(self) -> bool:
+        '''
+        根节点是否还有合法走法: 双方将帅都在, 而且轮到的一方没有被将死或者困毙.
+        搜索内部只产生伪合法走法, 所以在搜索之前先判断, 免得把不合法的走法交给界面
+        :return:
+        '''
+        if self.is_game_over(self.chess, 0):
+            return False
+        return self.move_generator.create_legal_move(self, 0, self.side) > 0
 
     def nega_max(self, depth):
         current = -20000
         i = self.is_game_over(self.chess, depth)
         if i:
             return i  # 棋局结束
+        if depth < self.max_depth:
+            rep = self.repetition()
+            if rep:
+                return REP_VALUE[rep]  # 重复局面不再往下搜
+            if self.quiet >= NATURAL_LIMIT:
+                return 0
         if depth <= 0:
-            return self.evaluation.evaluate(self.chess,
-                                            (self.max_depth - depth) % 2)
-        cnt = self.move_generator.create_possible_move(self.chess, depth,
-                                                       (self.max_depth - depth) % 2)
-        for i in range(cnt):
-            type = self.make_move(self.move_generator.move_list[depth][i])
+            return self.evaluation.evaluate(self, self.side)
+        ply = self.max_depth - depth  # 距离根节点的层数
+        generator = self.move_generator
+        if self.legal:
+            cnt = generator.create_legal_move(self, ply, self.side)
+            if not cnt:
+                return -19990 - depth  # 被将死或者困毙
+        else:
+            cnt = generator.create_possible_move(self, ply, self.side)
+        begin = generator.ply_start[ply]
+        for i in range(begin, begin + cnt):
+            move = generator.moves[i]
+            type = self.make_move(move)
             score = -self.nega_max(depth - 1)
-            self.un_make_move(self.move_generator.move_list[depth][i], type)
+            self.un_make_move(move, type)
             if score > current:
                 current = score
                 if depth == self.max_depth:
-                    self.best_move = self.move_generator.move_list[depth][i]
+                    self.best_move = move
         return current
 
+
+HASH_EXACT = 0  # 置换表分值是精确值
+HASH_LOWER = 1  # 分值是下界(发生了beta截断)
+HASH_UPPER = 2  # 分值是上界(没有走法超过alpha)
+MATE_BOUND = 19900  # 绝对值超过它的分值是将帅被吃的分值, 与剩余深度有关, 存入置换表时换算成与深度无关的值
+TT_ENTRY_BYTES = 16  # 每一项占用的内存: 8字节键值 + 8字节打包的数据
+DELTA_MARGIN = 200  # 静态搜索的delta剪枝余量: 吃掉的子再加上这么多分都追不上alpha时, 不用试这个吃子走法
+QUIESCE_CHECK_PLY = 64  # 静态搜索中被将军时搜索全部应将走法, 连续将军超过这么多层(距离根节点)以后不再应将, 直接估值
+
+
+class TranspositionTable:
+    '''
+    置换表: 按局面的哈希值记录搜索过的深度、分值类型、分值和最佳走法.
+    所有项预先分配在两个数组里, 大小由内存预算决定, 不会随搜索增长. 每个桶有两项:
+    第0项深度优先, 只被更深(或者是上一次搜索留下的)结果替换; 第1项总是替换, 保存最近的结果.
+    数据打包成一个整数: 走法16位 | 深度8位 << 16 | 类型2位 << 24 | (分值 + 32768)16位 << 26 | 代数8位 << 42
+    '''
+
+    def __init__(self, size_mb: int = 16) -> None:
+        buckets = 1
+        while buckets * 4 * TT_ENTRY_BYTES <= size_mb << 20:  # 桶数取不超过预算的2的幂
+            buckets <<= 1
+        self.mask = buckets - 1
+        self.keys = array('Q', [0]) * (buckets * 2)
+        self.data = array('q', [0]) * (buckets * 2)
+        self.generation = 0  # 每次新的搜索加1, 深度优先项遇到旧的代数时也可以被替换
+
+    def clear(self):
+        '''
+        清空置换表
+        :return:
+        '''
+        self.keys = array('Q', [0]) * len(self.keys)
+        self.data = array('q', [0]) * len(self.data)
+        self.generation = 0
+
+    def new_search(self):
+        '''
+        开始新的一次搜索, 保留原来的内容
+        :return:
+        '''
+        self.generation = (self.generation + 1) & 255
+
+    def probe(self, key: int) -> Optional[Tuple[int, int, int, int]]:
+        '''
+        查找局面
+        :param key: 局面的哈希值
+        :return: (深度, 类型, 分值, 最佳走法), 没有找到时为None
+        '''
+        i = (key & self.mask) << 1
+        keys = self.keys
+        if keys[i] != key:
+            i += 1
+            if keys[i] != key:
+                return None
+        data = self.data[i]
+        return data >> 16 & 255, data >> 24 & 3, (data >> 26 & 0xFFFF) - 32768, data & 0xFFFF
+
+    def store(self, key: int, depth: int, flag: int, score: int, move: int):
+        '''
+        保存局面
+        :param key: 局面的哈希值
+        :param depth: 搜索深度
+        :param flag: HASH_EXACT, HASH_LOWER或HASH_UPPER
+        :param score: 分值
+        :param move: 最佳走法, 0表示没有
+        :return:
+        '''
+        i = (key & self.mask) << 1
+        keys, data = self.keys, self.data
+        old = data[i]
+        if keys[i] != key and (old >> 16 & 255) > depth and (old >> 42) == self.generation:
+            i += 1  # 深度优先项保存着本次搜索更深的结果, 放到总是替换项
+        elif not move and keys[i] == key:
+            move = old & 0xFFFF  # 没有最佳走法时保留原来的
+        keys[i] = key
+        data[i] = move | depth << 16 | flag << 24 | (score + 32768) << 26 | self.generation << 42
+
+
+class AlphaBetaEngine(NegamaxEngine):
+    '''
+    alpha-beta剪枝的负极大值搜索引擎(fail-soft): 返回值可以落在(alpha, beta)窗口之外, 是真实分值的一个更紧的界.
+    走法按置换表走法、吃子(MVV-LVA)、杀手走法、其余走法的顺序分阶段产生, 截断以后剩下的阶段不再产生.
+    pvs为True时改用主要变例搜索(NegaScout), 分值与alpha-beta相同. 目前的走法排序下零窗口搜索经常要重新搜索,
+    在常用的3~5层上节点数有时比alpha-beta还多, 所以默认不开.
+    叶子节点上接着做静态搜索, 把正在进行的兑子、吃子走完再估值, 避免水平线效应
+    '''
+
+    def __init__(self, search_depth, hash_mb: int = 16, keep_hash: bool = False, pvs: bool = False,
+                 quiesce: bool = True) -> None:
+        super().__init__(search_depth)
+        self.pvs = pvs  # 为True时使用主要变例搜索(NegaScout), 否则是普通的alpha-beta. 不一定更省节点, 默认关闭
+        self.quiesce = quiesce  # 为True时在叶子节点上继续做只搜索吃子走法的静态搜索, 否则直接估值
+        self.nodes = 0  # 搜索过的节点数
+        self.table = TranspositionTable(hash_mb)  # 置换表, 按左右镜像合并后的canonical_hash存取
+        self.keep_hash = keep_hash  # 为True时多次search_a_good_move之间保留置换表, 连续对局时可以用到上一步的结果
+        self.deadline = None  # 本次迭代必须停下的时刻(time.perf_counter), None表示不限时
+        self.stopped = False  # 时间用完, 正在退出本次迭代
+        self.pv = []  # 上一次完成的迭代的主要变例
+        self.score = 0  # 上一次完成的迭代的分值
+        self.depth_reached = 0  # 完成的最大深度
+        # 估值时直接读增量维护的攻击图, 不用在每个叶子上重新扫描全部棋子, 搜索结果不变, 速度快15%~35%
+        self.track_attacks = True
+
+    def search_a_good_move(self, chess, side=0, time_ms=None, max_depth=None, history=None):
+        '''
+        迭代加深搜索一步好棋: 从1层开始逐层加深, 每一层先走上一层的主要变例(置换表中的最佳走法),
+        时间用完时放弃正在进行的一层, 返回最后完成的一层的最佳走法. 第1层总会完成
+        :param chess: 红子在下方的10 \times 9棋盘
+        :param side: 替哪一方走, 1为红方, 0为黑方
+        :param time_ms: 时间预算(毫秒), None表示不限时
+        :param max_depth: 最大深度, 默认为search_depth
+        :param history: 对局中已经走过的棋, 不为None时chess是开局的棋盘, side是开局时走棋的一方, 见load
+        :return: [old_i, old_j, i, j]; 没有合法走法(被将死、困毙或者将帅已经被吃)时返回None
+        '''
+        start = time.perf_counter()
+        max_depth = max_depth or self.search_depth
+        self.best_move = 0
+        self.load(chess, side, history)
+        if not self.has_legal_move():
+            return None
+        self.nodes = 0
+        self.move_generator.killers = [[0, 0] for _ in range(64)]
+        if self.keep_hash:
+            self.table.new_search()
+        else:
+            self.table.clear()
+        self.pv = []
+        self.stopped = False
+        self.deadline = None
+        best_move = 0
+        for depth in range(1, max_depth + 1):
+            self.max_depth = depth
+            score = self.alpha_beta(depth, -20000, 20000)
+            if self.stopped:
+                break
+            best_move, self.score, self.depth_reached = self.best_move, score, depth
+            self.pv = self.principal_variation(depth)
+            if time_ms is not None:
+                elapsed = (time.perf_counter() - start) * 1000
+                # 下一层通常要花这一层好几倍的时间, 剩下的时间不到一半时就不再开始
+                if elapsed * 2 >= time_ms or score > MATE_BOUND or score < -MATE_BOUND:
+                    break
+                self.deadline = start + time_ms / 1000
+        self.best_move = best_move
+        return ChessmanMove.from_code(best_move).to_list()
+
+    def principal_variation(self, depth: int) -> List[int]:
+        '''
+        从置换表中取出当前局面的主要变例
+        :param depth: 最多取多少步
+        :return: move_code编码的走法列表
+        '''
+        pv = []
+        seen = set()
+        while len(pv) < depth and self.hash not in seen:
+            seen.add(self.hash)
+            entry = self.table.probe(self.canonical_hash())
+            if not entry or not entry[3]:
+                break
+            move = self.canonical_move(entry[3])
+            if not self.move_generator.is_pseudo_legal(self, move, self.side):
+                break
+            pv.append(move)
+            self.make_move(move)
+        for move in reversed(pv):
+            code = self.move_history[-1]
+            self.un_make_move(move, code & 15)
+        return pv
+
+    def quiescence(self, alpha: int, beta: int, ply: int) -> int:
+        '''
+        静态搜索: 走棋方可以不吃子, 直接取估值(stand pat), 也可以吃子, 只搜索吃子走法直到局面平静.
+        吃子走法按MVV-LVA排序, 吃掉的子再加上DELTA_MARGIN都达不到alpha的走法直接跳过(delta剪枝).
+        被将军时不能不应将, 不取估值, 改为搜索全部合法走法(应将), 无棋可走就是被将死
+        :param alpha:
+        :param beta:
+        :param ply: 距离根节点的层数
+        :return: 分值, fail-soft
+        '''
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 255 and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.stopped:
+            return 0
+        i = self.is_game_over(self.chess, 0)
+        if i:
+            return i  # 将帅被吃
+        generator = self.move_generator
+        begin = generator.ply_start[ply]
+        evasion = ply < QUIESCE_CHECK_PLY and self.in_check()
+        if evasion:
+            rep = self.repetition()
+            if rep:
+                return REP_VALUE[rep]  # 长将
+            end = begin + generator.create_legal_move(self, ply, self.side)
+            if begin == end:
+                return -19990  # 被将死或者困毙
+            best = -20000
+        else:
+            best = stand_pat = self.evaluation.evaluate(self, self.side)
+            if best >= beta:
+                return best
+            end = begin + generator.gen_captures(self, ply, self.side)
+        generator.sort_captures(self, begin, end)
+        base_value = self.evaluation.base_value
+        chess = self.chess
+        for idx in range(begin, end):
+            move = generator.moves[idx]
+            if not evasion and stand_pat + base_value[chess[move & 255]] + DELTA_MARGIN <= max(alpha, best):
+                continue
+            chess_id = self.make_move(move)
+            score = -self.quiescence(-beta, -max(alpha, best), ply + 1)
+            self.un_make_move(move, chess_id)
+            if self.stopped:
+                return 0
+            if score > best:
+                best = score
+                if score >= beta:
+                    break
+        return best
+
+    def alpha_beta(self, depth: int, alpha: int, beta: int) -> int:
+        '''
+        alpha-beta搜索, 分值总是对轮到走棋的一方而言
+        :param depth: 剩余深度
+        :param alpha: 下界, 走棋方已经有把握得到的分数
+        :param beta: 上界, 超过它对方就不会让局面走到这里
+        :return: 分值, 不超过alpha时是上界, 不低于beta时是下界
+        '''
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 255 and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.stopped:
+            return 0  # 时间用完, 分值作废, 逐层退回根节点
+        i = self.is_game_over(self.chess, depth)
+        if i:
+            return i  # 棋局结束
+        ply = self.max_depth - depth
+        if ply:
+            rep = self.repetition()
+            if rep:
+                return REP_VALUE[rep]
+            if self.quiet >= NATURAL_LIMIT:
+                return 0
+        if depth <= 0:
+            if self.quiesce:
+                return self.quiescence(alpha, beta, ply)
+            return self.evaluation.evaluate(self, self.side)
+        # 查置换表: 足够深的结果可以直接返回(根节点除外, 根节点需要走法), 否则至少用它的最佳走法先搜
+        key = self.canonical_hash()
+        hash_move = 0
+        entry = self.table.probe(key)
+        if entry:
+            hash_depth, flag, score, hash_move = entry
+            if hash_move:
+                hash_move = self.canonical_move(hash_move)
+        if not ply and not hash_move and self.pv:
+            hash_move = self.pv[0]  # 置换表中的根节点被覆盖时, 仍然先走上一层的最佳走法
+        if entry:
+            if ply and hash_depth >= depth:
+                if score > MATE_BOUND:
+                    score += depth
+                elif score < -MATE_BOUND:
+                    score -= depth
+                if flag == HASH_EXACT or flag == HASH_LOWER and score >= beta \
+                        or flag == HASH_UPPER and score <= alpha:
+                    return score
+        generator = self.move_generator
+        best = -20000
+        best_move = 0
+        for move in generator.staged_moves(self, ply, self.side, hash_move):
+            chess_id = self.make_move(move)
+            if not self.pvs or not best_move:
+                score = -self.alpha_beta(depth - 1, -beta, -max(alpha, best))
+            else:
+                # 主要变例搜索: 第一个走法之后的走法多半不如它, 先用零窗口证明这一点;
+                # 零窗口搜索的结果超过了窗口下界(还没到beta)时, 才用完整的窗口重新搜索
+                lower = max(alpha, best)
+                score = -self.alpha_beta(depth - 1, -lower - 1, -lower)
+                if lower < score < beta and not self.stopped:
+                    score = -self.alpha_beta(depth - 1, -beta, -lower)
+            self.un_make_move(move, chess_id)
+            if self.stopped:
+                return 0
+            if score > best:
+                best = score
+                best_move = move
+                if not ply:
+                    self.best_move = move
+                if score >= beta:
+                    if chess_id == Chessman.NOCHESS:
+                        generator.add_killer(ply, move)
+                    break
+        # 存入置换表, 将帅被吃的分值换算成与剩余深度无关的值
+        flag = HASH_UPPER if best <= alpha else HASH_LOWER if best >= beta else HASH_EXACT
+        score = best - depth if best > MATE_BOUND else best + depth if best < -MATE_BOUND else best
+        self.table.store(key, depth, flag, score, self.canonical_move(best_move) if best_move else best_move)
+        return best
+
+
+'''
+位棋盘后端
+
+    用Python的整数当作90位的位棋盘, 第i行第j列对应第 i * 9 + j 位. 每一种棋子一个位棋盘, 双方各一个占用位棋盘.
+    走法由预先计算好的掩码经过移位、与运算得到, 生成吃子走法和判断某个位置是否被攻击都只是与运算.
+    BitboardEngine继承NegamaxEngine, 对外提供相同的create_possible_move/make_move接口,
+    可以和一维棋盘后端在同样的局面上做对比测试.
+'''
+BB_FULL = (1 << 90) - 1
+BB_BIT = [0] * BOARD_SIZE  # 一维棋盘位置对应的位棋盘比特
+BB_SQUARE = [square(k // 9, k % 9) for k in range(90)]  # 位棋盘第k位对应的一维棋盘位置
+BB_FILE_A = sum(1 << (i * 9) for i in range(10))  # 第0列
+BB_FILE_I = BB_FILE_A << 8  # 第8列
+BB_RED_CROSSED = (1 << 45) - 1  # 第0~4行, 红兵过河后所在的区域
+BB_BLACK_CROSSED = BB_FULL ^ BB_RED_CROSSED  # 第5~9行, 黑卒过河后所在的区域
+BB_FILE_SPREAD = [0] * 1024  # 10位的列位图展开成第0列上的位棋盘, 再左移j位就是第j列
+BB_KING = ([0] * BOARD_SIZE, [0] * BOARD_SIZE)  # 将帅在九宫内的攻击掩码
+BB_ADVISOR = ([0] * BOARD_SIZE, [0] * BOARD_SIZE)  # 仕的攻击掩码
+BB_ELEPHANT = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # 象: (象眼比特, 目标比特)
+BB_HORSE = [()] * BOARD_SIZE  # 马: (马腿比特, 这条马腿管住的两个目标的掩码)
+BB_HORSE_ATTACKERS = [()] * BOARD_SIZE  # 反查能攻击某位置的马: (马腿比特, 两个马所在位置的掩码)
+BB_ELEPHANT_ATTACKERS = ([()] * BOARD_SIZE, [()] * BOARD_SIZE)  # 反查能攻击某位置的象: (象眼比特, 象所在比特)
+BB_PAWN_ATTACKERS = ([0] * BOARD_SIZE, [0] * BOARD_SIZE)  # 反查能攻击某位置的兵卒所在的掩码
+BB_RANK_SLIDES = [None] * BOARD_SIZE  # 与RANK_SLIDES相同, 偏移量元组换成行内的9位掩码
+BB_FILE_SLIDES = [None] * BOARD_SIZE  # 与FILE_SLIDES相同, 偏移量元组换成列内的10位掩码
+
+
+def bit_slide_table(length: int) -> List[List[Tuple[int, int, int]]]:
+    '''
+    把slide_table得到的偏移量换成一条线上的位掩码
+    :param length: 9表示一行, 10表示一列
+    :return:
+    '''
+    table = []
+    for p, entries in enumerate(slide_table(length, 1)):
+        table.append([tuple(sum(1 << (p + delta) for delta in deltas) for deltas in entry) for entry in entries])
+    return table
+
+
+def init_bitboard_tables():
+    '''
+    建立位棋盘后端用到的掩码, 位棋盘的掩码都由一维棋盘的走法表转换而来
+    '''
+    for k, sq in enumerate(BB_SQUARE):
+        BB_BIT[sq] = 1 << k
+    for m in range(1024):
+        BB_FILE_SPREAD[m] = sum(1 << (i * 9) for i in range(10) if m >> i & 1)
+    rank_table = bit_slide_table(9)
+    file_table = bit_slide_table(10)
+    for sq in SQUARES:
+        BB_RANK_SLIDES[sq] = rank_table[file_of(sq)]
+        BB_FILE_SLIDES[sq] = file_table[rank_of(sq)]
+        legs = {}
+        for to, leg in HORSE_MOVES[sq]:
+            legs[leg] = legs.get(leg, 0) | BB_BIT[to]
+        BB_HORSE[sq] = tuple((BB_BIT[leg], mask) for leg, mask in legs.items())
+        for side in (0, 1):
+            BB_KING[side][sq] = sum(BB_BIT[to] for to in KING_MOVES[side][sq])
+            BB_ADVISOR[side][sq] = sum(BB_BIT[to] for to in ADVISOR_MOVES[side][sq])
+            BB_ELEPHANT[side][sq] = tuple((BB_BIT[eye], BB_BIT[to]) for to, eye in ELEPHANT_MOVES[side][sq])
+    # 反查表: 从每个棋子的走法表倒推能攻击到目标位置的棋子
+    horse_attackers = [{} for _ in range(BOARD_SIZE)]
+    elephant_attackers = ([[] for _ in range(BOARD_SIZE)], [[] for _ in range(BOARD_SIZE)])
+    for sq in SQUARES:
+        for to, leg in HORSE_MOVES[sq]:
+            horse_attackers[to][leg] = horse_attackers[to].get(leg, 0) | BB_BIT[sq]
+        for side in (0, 1):
+            for to, eye in ELEPHANT_MOVES[side][sq]:
+                elephant_attackers[side][to].append((BB_BIT[eye], BB_BIT[sq]))
+    for sq in SQUARES:
+        BB_HORSE_ATTACKERS[sq] = tuple((BB_BIT[leg], mask) for leg, mask in horse_attackers[sq].items())
+        for side in (0, 1):
+            BB_ELEPHANT_ATTACKERS[side][sq] = tuple(elephant_attackers[side][sq])
+        # 红兵从下方或者过河后从左右攻击, 黑卒从上方或者过河后从左右攻击
+        red, black = BB_BIT[sq + 16], BB_BIT[sq - 16]
+        if rank_of(sq) <= 4:
+            red |= BB_BIT[sq - 1] | BB_BIT[sq + 1]
+        else:
+            black |= BB_BIT[sq - 1] | BB_BIT[sq + 1]
+        BB_PAWN_ATTACKERS[1][sq], BB_PAWN_ATTACKERS[0][sq] = red, black
+
+
+init_bitboard_tables()
+
+
+class BitboardMoveGenerator(MoveGenerator):
+    '''
+    位棋盘走法产生器
+    '''
+
+    def create_possible_move(self, pos: 'BitboardEngine', ply: int, side: int) -> int:
+        '''
+        产生一层的所有可能的走法, 目标位置只能是空位或者对方棋子
+        :param pos: 位棋盘局面
+        :param ply: 距离根节点的层数
+        :param side: 是否是红子
+        :return: 走法数量
+        '''
+        self.begin_ply(ply)
+        self.gen_bitboard_moves(pos, side, BB_FULL ^ pos.side_bb[side])
+        return self.end_ply(ply)
+
+    def gen_captures(self, pos: 'BitboardEngine', ply: int, side: int, append: bool = False) -> int:
+        '''
+        只产生吃子走法, 目标掩码就是对方的占用位棋盘
+        :param pos:
+        :param ply:
+        :param side:
+        :param append: 接在这一层已经产生的走法后面
+        :return:
+        '''
+        self.begin_ply(ply, append)
+        self.gen_bitboard_moves(pos, side, pos.side_bb[1 - side])
+        return self.end_ply(ply)
+
+    def gen_quiets(self, pos: 'BitboardEngine', ply: int, side: int, append: bool = False) -> int:
+        '''
+        只产生不吃子的走法, 目标掩码就是空位
+        :param pos:
+        :param ply:
+        :param side:
+        :param append: 接在这一层已经产生的走法后面
+        :return:
+        '''
+        self.begin_ply(ply, append)
+        self.gen_bitboard_moves(pos, side, BB_FULL ^ pos.side_bb[0] ^ pos.side_bb[1])
+        return self.end_ply(ply)
+
+    def add_bitboard_moves(self, sq: int, targets: int):
+        '''
+        把掩码中的每一个目标位置都作为sq出发的走法压入走法栈
+        :param sq:
+        :param targets:
+        :return:
+        '''
+        while targets:
+            low = targets & -targets
+            self.add_move(sq, BB_SQUARE[low.bit_length() - 1])
+            targets ^= low
+
+    def gen_bitboard_moves(self, pos: 'BitboardEngine', side: int, target: int):
+        '''
+        产生走法, 所有走法的目标位置都限制在target掩码之内
+        :param pos:
+        :param side:
+        :param target: 目标位置掩码
+        :return:
+        '''
+        bitboards = pos.bitboards
+        enemy = pos.side_bb[1 - side]
+        occ = pos.side_bb[side] | enemy
+        base = 0 if side == 0 else Chessman.R_KING - Chessman.B_KING  # 红子的编号比同类黑子大7
+        for sq in self.bit_squares(bitboards[Chessman.B_CAR + base]):
+            rank = BB_RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+            file = BB_FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+            shift = rank_of(sq) * 9
+            attacks = ((rank[0] | rank[1]) << shift) | (BB_FILE_SPREAD[file[0] | file[1]] << file_of(sq))
+            self.add_bitboard_moves(sq, attacks & target)
+        for sq in self.bit_squares(bitboards[Chessman.B_CANNON + base]):
+            rank = BB_RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+            file = BB_FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+            shift, j = rank_of(sq) * 9, file_of(sq)
+            attacks = (rank[0] << shift) | (BB_FILE_SPREAD[file[0]] << j) \
+                | (((rank[2] << shift) | (BB_FILE_SPREAD[file[2]] << j)) & enemy)
+            self.add_bitboard_moves(sq, attacks & target)
+        for sq in self.bit_squares(bitboards[Chessman.B_HORSE + base]):
+            attacks = 0
+            for leg, mask in BB_HORSE[sq]:
+                if not occ & leg:
+                    attacks |= mask
+            self.add_bitboard_moves(sq, attacks & target)
+        for sq in self.bit_squares(bitboards[Chessman.B_ELEPHANT + base]):
+            attacks = 0
+            for eye, bit in BB_ELEPHANT[side][sq]:
+                if not occ & eye:
+                    attacks |= bit
+            self.add_bitboard_moves(sq, attacks & target)
+        for sq in self.bit_squares(bitboards[Chessman.B_BISHOP + base]):
+            self.add_bitboard_moves(sq, BB_ADVISOR[side][sq] & target)
+        for sq in self.bit_squares(bitboards[Chessman.B_KING + base]):
+            # 将帅照面: 同一列上车能攻击到的位置正好是对方的将帅
+            file = BB_FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+            facing = (BB_FILE_SPREAD[file[1]] << file_of(sq)) & bitboards[Chessman.R_KING - base]
+            self.add_bitboard_moves(sq, (BB_KING[side][sq] | facing) & target)
+        # 兵卒整体移位: 红兵向上是右移9位, 黑卒向下是左移9位, 过河后左右平移1位
+        pawns = bitboards[Chessman.B_PAWN + base]
+        if side:
+            crossed = pawns & BB_RED_CROSSED
+            self.add_shifted_moves((pawns >> 9) & target, 9)
+        else:
+            crossed = pawns & BB_BLACK_CROSSED
+            self.add_shifted_moves((pawns << 9) & target, -9)
+        self.add_shifted_moves(((crossed & ~BB_FILE_A) >> 1) & target, 1)
+        self.add_shifted_moves(((crossed & ~BB_FILE_I) << 1) & target, -1)
+
+    def add_shifted_moves(self, targets: int, offset: int):
+        '''
+        整体移位得到的目标掩码, 每个目标的起点都在 目标比特 + offset 处
+        :param targets:
+        :param offset: 起点相对目标的比特偏移
+        :return:
+        '''
+        while targets:
+            low = targets & -targets
+            k = low.bit_length() - 1
+            self.add_move(BB_SQUARE[k + offset], BB_SQUARE[k])
+            targets ^= low
+
+    def bit_squares(self, bitboard: int) -> List[int]:
+        '''
+        位棋盘中所有棋子所在的一维棋盘位置
+        :param bitboard:
+        :return:
+        '''
+        squares = []
+        while bitboard:
+            low = bitboard & -bitboard
+            squares.append(BB_SQUARE[low.bit_length() - 1])
+            bitboard ^= low
+        return squares
+
+    def is_attacked(self, pos: 'BitboardEngine', sq: int, side: int) -> bool:
+        '''
+        判断位置sq是否被side一方攻击, 全部用反查掩码做与运算
+        :param pos:
+        :param sq:
+        :param side: 攻击方
+        :return:
+        '''
+        bitboards = pos.bitboards
+        base = 0 if side == 0 else Chessman.R_KING - Chessman.B_KING
+        occ = pos.side_bb[0] | pos.side_bb[1]
+        rank = BB_RANK_SLIDES[sq][pos.rank_occ[sq >> 4]]
+        file = BB_FILE_SLIDES[sq][pos.file_occ[sq & 15]]
+        shift, j = rank_of(sq) * 9, file_of(sq)
+        # 车: 从sq出发车能吃到的位置; sq上是将帅时, 对方的将帅出现在这些位置上就是照面
+        file_car = BB_FILE_SPREAD[file[1]] << j
+        if ((rank[1] << shift) | file_car) & bitboards[Chessman.B_CAR + base]:
+            return True
+        if file_car & bitboards[Chessman.B_KING + base] and pos.chess[sq] + Chessman.B_KING + base == 9:
+            return True
+        # 炮: 从sq出发炮能吃到的位置
+        if ((rank[2] << shift) | (BB_FILE_SPREAD[file[2]] << j)) & bitboards[Chessman.B_CANNON + base]:
+            return True
+        if BB_PAWN_ATTACKERS[side][sq] & bitboards[Chessman.B_PAWN + base]:
+            return True
+        if BB_KING[side][sq] & bitboards[Chessman.B_KING + base]:
+            return True
+        if BB_ADVISOR[side][sq] & bitboards[Chessman.B_BISHOP + base]:
+            return True
+        horses = bitboards[Chessman.B_HORSE + base]
+        if horses:
+            for leg, mask in BB_HORSE_ATTACKERS[sq]:
+                if mask & horses and not occ & leg:
+                    return True
+        elephants = bitboards[Chessman.B_ELEPHANT + base]
+        if elephants:
+            for eye, bit in BB_ELEPHANT_ATTACKERS[side][sq]:
+                if bit & elephants and not occ & eye:
+                    return True
+        return False
+
+
+class BitboardEngine(NegamaxEngine):
+    '''
+    使用位棋盘产生走法的负极大值搜索引擎, 一维棋盘仍然保留, 用来查询某个位置上是什么棋子以及估值
+    '''
+
+    def __init__(self, search_depth) -> None:
+        super().__init__(search_depth)
+        self.move_generator = BitboardMoveGenerator()
+        self.bitboards = [0] * 15  # 每一种棋子的位棋盘
+        self.side_bb = [0, 0]  # 双方的占用位棋盘
+
+    def load_board(self, board: bytearray, side: int = 0, quiet: int = 0):
+        super().load_board(board, side, quiet)
+        self.bitboards = [0] * 15
+        self.side_bb = [0, 0]
+        for side in (0, 1):
+            for sq in self.pieces[side]:
+                self.bitboards[self.chess[sq]] |= BB_BIT[sq]
+                self.side_bb[side] |= BB_BIT[sq]
+
+    def make_move(self, move: int) -> int:
+        fron, to = move >> 8, move & 255
+        id = self.chess[fron]
+        side = PIECE_SIDE[id]
+        bits = BB_BIT[fron] | BB_BIT[to]
+        self.bitboards[id] ^= bits
+        self.side_bb[side] ^= bits
+        chess_id = super().make_move(move)
+        if chess_id != Chessman.NOCHESS:
+            self.bitboards[chess_id] ^= BB_BIT[to]
+            self.side_bb[1 - side] ^= BB_BIT[to]
+        return chess_id
+
+    def un_make_move(self, move: int, chess_id: int):
+        fron, to = move >> 8, move & 255
+        id = self.chess[to]
+        side = PIECE_SIDE[id]
+        bits = BB_BIT[fron] | BB_BIT[to]
+        self.bitboards[id] ^= bits
+        self.side_bb[side] ^= bits
+        if chess_id != Chessman.NOCHESS:
+            self.bitboards[chess_id] ^= BB_BIT[to]
+            self.side_bb[1 - side] ^= BB_BIT[to]
+        super().un_make_move(move, chess_id)
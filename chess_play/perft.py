@@ -0,0 +1,165 @@
+'''
+    走法产生器的perft测试
+
+对一组局面统计走depth步的合法走法序列个数, 与已知的结果对比, 同时给出每秒的节点数.
+每次修改棋盘表示或者走法产生器之后跑一遍, 既能发现走法错误, 也能看出速度的变化.
+深度较大时可以用 --processes 把根节点的走法分给多个进程, --hash 让每个进程缓存(局面, 深度)的结果.
+用法:
+    python -m chess_play.perft [depth] [--bitboard] [--divide N] [--processes N] [--hash] [--epd FILE]
+'''
+from typing import *
+import argparse
+import multiprocessing
+import time
+from chess_play.core import NegamaxEngine, BitboardEngine, SearchEngine, START_FEN, read_epd
+
+# (名字, FEN, 第1, 2, 3...层的节点数)
+# 初始局面的结果与公开的象棋perft结果一致, 其余局面由初始局面随机走若干步得到, 结果用一个独立的简单走法产生器核对过
+PERFT_SUITE = [
+    ('初始局面', START_FEN, (44, 1920, 79666, 3290240)),
+    ('开局', 'rnbakabnr/9/8c/pcp1p1p1p/9/1CP5P/P3P1P2/9/4A4/R1BAK1BNR w - - 0 1', (28, 856, 24839)),
+    ('中局1', '2ra1abn1/4k4/2n1b2cr/p1p3p1p/4p1C2/5CP2/P1P1P3P/B3K4/R2N5/3A1ABNR w - - 0 1', (38, 1056, 39070)),
+    ('中局2', 'r2akab2/4r4/n3b1n2/2p3p1p/p1C1p2c1/P5BC1/2P1P1P1c/2N6/4A3R/R1BAK2N1 b - - 0 1', (40, 1396, 56112)),
+    ('中局3', '1n2k1bn1/r3a4/3cb4/2p5p/p1N1P4/6p1C/P1P5P/3ABr3/3c5/RNBAK4 w - - 0 1', (24, 1332, 29790)),
+    ('中局4', '1n1a1ab2/4kr3/2C1b4/1r2p1cRp/9/PcP3p1P/4P1P2/R3B3B/4AN3/1N3K3 w - - 0 1', (39, 1512, 57009)),
+    ('被将军', 'rn1a1an2/3Ck4/b3P4/6p2/p1p6/P5P1P/9/8R/4K4/1NBA3NR b - - 0 1', (3, 103, 1077)),
+    ('残局', '1cbc1abn1/1C2k4/3a5/p7p/4p1P2/P1P5P/1r4RN1/B8/4A4/4KAB2 w - - 0 1', (30, 844, 25778)),
+    ('车马炮残局', '4ka3/3na2R1/6n1b/1C2prP2/C7P/1cP6/N3P4/4BA1NR/9/3AK1B2 b - - 0 1', (25, 1298, 33885)),
+]
+
+
+# 工作进程中的搜索引擎和缓存, 由_init_worker在每个进程启动时建立一次
+_worker_engine = None
+_worker_table = None
+
+
+def _init_worker(engine_class: type, fen: str, use_hash: bool):
+    global _worker_engine, _worker_table
+    _worker_engine = engine_class(1)
+    _worker_engine.load_fen(fen)
+    _worker_table = {} if use_hash else None
+
+
+def _perft_root_move(task: Tuple[int, int]) -> int:
+    '''
+    工作进程: 走一步根节点的走法, 统计下面depth - 1层的节点数
+    :param task: (走法, depth)
+    :return:
+    '''
+    move, depth = task
+    engine = _worker_engine
+    chess_id = engine.make_move(move)
+    nodes = engine.perft(depth - 1, 1, _worker_table)
+    engine.un_make_move(move, chess_id)
+    return nodes
+
+
+def parallel_perft(engine_class: type, fen: str, depth: int,
+                   processes: Optional[int] = None, use_hash: bool = False) -> int:
+    '''
+    在根节点把走法分给多个进程并行统计, 再把结果加起来
+    :param engine_class: NegamaxEngine或BitboardEngine
+    :param fen: 局面
+    :param depth:
+    :param processes: 进程数, 默认为CPU核数
+    :param use_hash: 每个进程是否缓存(局面, 深度)的结果
+    :return: 节点数
+    '''
+    engine = engine_class(1)
+    engine.load_fen(fen)
+    cnt = engine.move_generator.create_legal_move(engine, 0, engine.side)
+    if depth <= 1:
+        return cnt
+    tasks = [(move, depth) for move in engine.move_generator.moves[:cnt]]
+    with multiprocessing.Pool(processes, _init_worker, (engine_class, fen, use_hash)) as pool:
+        # 每个根节点走法下面的节点数相差很大, 逐个分配才能让各进程的负载均衡
+        return sum(pool.imap_unordered(_perft_root_move, tasks, chunksize=1))
+
+
+def run_perft(engine: SearchEngine, fen: str, depth: int,
+              processes: int = 1, use_hash: bool = False) -> Tuple[int, float]:
+    '''
+    在一个局面上跑perft
+    :param engine: 搜索引擎, 决定用哪一种棋盘表示
+    :param fen: 局面
+    :param depth:
+    :param processes: 大于1时在根节点分给多个进程
+    :param use_hash: 是否缓存(局面, 深度)的结果
+    :return: (节点数, 用时秒数)
+    '''
+    start = time.perf_counter()
+    if processes > 1:
+        nodes = parallel_perft(type(engine), fen, depth, processes, use_hash)
+    else:
+        engine.load_fen(fen)
+        nodes = engine.perft(depth, 0, {} if use_hash else None)
+    return nodes, time.perf_counter() - start
+
+
+def read_suite(path: str) -> Iterator[Tuple[str, str, Tuple[int, ...]]]:
+    '''
+    从EPD文件读取测试集, 每行的D1, D2...操作是各层的节点数, id操作是局面的名字
+    :param path:
+    :return: 与PERFT_SUITE相同格式的(名字, FEN, 各层节点数), 逐个产生
+    '''
+    for n, (fen, ops) in enumerate(read_epd(path)):
+        expected = []
+        while 'D%d' % (len(expected) + 1) in ops:
+            expected.append(int(ops['D%d' % (len(expected) + 1)]))
+        yield ops.get('id', str(n)), fen, tuple(expected)
+
+
+def run_suite(engine: SearchEngine, depth: int, processes: int = 1, use_hash: bool = False,
+              suite: Iterable[Tuple[str, str, Tuple[int, ...]]] = PERFT_SUITE) -> bool:
+    '''
+    跑整个测试集, 每个局面跑到depth层(已知结果不够depth层的跑到已知的最深一层), 打印节点数、是否正确以及每秒节点数
+    :param engine:
+    :param depth:
+    :param processes: 进程数
+    :param use_hash: 是否缓存(局面, 深度)的结果
+    :param suite: 测试集, 默认为PERFT_SUITE
+    :return: 是否全部正确
+    '''
+    all_ok = True
+    total_nodes, total_time = 0, 0.0
+    for name, fen, expected in suite:
+        if not expected:
+            continue
+        d = min(depth, len(expected))
+        nodes, seconds = run_perft(engine, fen, d, processes, use_hash)
+        ok = nodes == expected[d - 1]
+        all_ok = all_ok and ok
+        total_nodes += nodes
+        total_time += seconds
+        print('%-8s depth %d  nodes %10d  expected %10d  %s  %8.0f nps'
+              % (name, d, nodes, expected[d - 1], 'ok' if ok else 'FAIL', nodes / max(seconds, 1e-9)))
+    print('total nodes %d  time %.2fs  %.0f nps' % (total_nodes, total_time, total_nodes / max(total_time, 1e-9)))
+    return all_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='象棋走法产生器perft测试')
+    parser.add_argument('depth', type=int, nargs='?', default=3, help='搜索深度')
+    parser.add_argument('--bitboard', action='store_true', help='使用位棋盘后端')
+    parser.add_argument('--divide', type=int, default=None, metavar='N', help='打印第N个局面根节点每个走法的结果')
+    parser.add_argument('--processes', type=int, default=1, metavar='N', help='在根节点把走法分给N个进程, 0表示CPU核数')
+    parser.add_argument('--hash', action='store_true', help='每个进程缓存(局面, 深度)的结果')
+    parser.add_argument('--epd', default=None, metavar='FILE', help='从EPD文件读取测试集, 节点数写在D1, D2...操作中')
+    args = parser.parse_args()
+    engine = BitboardEngine(1) if args.bitboard else NegamaxEngine(1)
+    suite = read_suite(args.epd) if args.epd else PERFT_SUITE
+    if args.divide is not None:
+        name, fen, expected = list(suite)[args.divide]
+        engine.load_fen(fen)
+        result = engine.divide(args.depth)
+        for move, nodes in sorted(result.items()):
+            print('%s %d' % (move.to_list(), nodes))
+        print('moves %d  nodes %d' % (len(result), sum(result.values())))
+        return
+    processes = args.processes or multiprocessing.cpu_count()
+    if not run_suite(engine, args.depth, processes, args.hash, suite):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+    走棋规则
+
+界面和网络对战的服务端共用的走法合法性判断. 每一回合只用走法产生器产生一次当前局面的全部合法走法,
+缓存成集合, 之后每次点击只需要查一下集合. 缓存按局面的Zobrist哈希值(包含轮到哪一方走)区分,
+传入的棋盘变了就会重新产生, 调用方不需要记得调用invalidate.
+合法走法不包括走完以后己方将帅被攻击或者将帅照面的走法.
+'''
+from typing import *
+from chess_play.core import SearchEngine, rank_of, file_of, flip_chess, flip_point
+
+
+class Rules:
+    '''
+    走棋规则服务
+    '''
+
+    def __init__(self, up_red: bool = False) -> None:
+        self.up_red = up_red  # 调用方(界面)的棋盘是否红子在上方, 引擎总是红子在下方, 是的话进出引擎时上下翻转
+        self.engine = SearchEngine()
+        self.legal = None  # 缓存的合法走法集合, 元素是调用方坐标下的(old_i, old_j, i, j), None表示需要重新产生
+        self.key = None  # 缓存的是哪一个局面的走法, 为局面的哈希值
+
+    def legal_moves(self, chess: List[List[int]], side: int) -> Set[Tuple[int, int, int, int]]:
+        '''
+        当前局面下side一方的全部合法走法, 同一局面只产生一次
+        :param chess: 10 \times 9棋盘
+        :param side: 1为红方, 0为黑方
+        :return:
+        '''
+        engine = self.engine
+        engine.load(flip_chess(chess) if self.up_red else chess, side)
+        if self.legal is None or self.key != engine.hash:
+            generator = engine.move_generator
+            cnt = generator.create_legal_move(engine, 0, side)
+            legal = set()
+            for move in generator.moves[:cnt]:
+                fron, to = move >> 8, move & 255
+                old_point, point = (rank_of(fron), file_of(fron)), (rank_of(to), file_of(to))
+                if self.up_red:
+                    old_point, point = flip_point(*old_point), flip_point(*point)
+                legal.add(old_point + point)
+            self.legal, self.key = legal, engine.hash
+        return self.legal
+
+    def is_legal(self, chess: List[List[int]], side: int, old_i: int, old_j: int, i: int, j: int) -> bool:
+        '''
+        判断一步棋是否合法
+        :param chess: 10 \times 9棋盘
+        :param side: 走棋的一方, 1为红方, 0为黑方
+        :param old_i: 起始位置的row
+        :param old_j: 起始位置的col
+        :param i: 目标位置的row
+        :param j: 目标位置的col
+        :return:
+        '''
+        return (old_i, old_j, i, j) in self.legal_moves(chess, side)
+
+    def invalidate(self):
+        '''
+        丢掉缓存的走法, 下次查询时重新产生. 缓存已经按局面区分, 这里只是提前释放
+        :return:
+        '''
+        self.legal = None
@@ -4,7 +4,12 @@
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
+import os, sys
+dir_path = os.path.dirname(os.path.realpath(__file__))
+parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
+sys.path.insert(0, parent_dir_path)
 import resources_rc  # 不导包的话程序无法使用图片资源, 而且不会报错
+from chess_play.rules import Rules
 
 
 class Chessman:
@@ -101,6 +106,7 @@ class MainWindow(QWidget):
         self.click_state = 0  # 鼠标点击状态, 一共有三种, 0: 未选中, 1: 选中, 2: 移动
         self.old_point = None  # 要移动的棋子位置
         self.game_state = GameState.RED
+        self.rules = Rules(up_red=True)  # 走棋规则, 这个棋盘红子在上方
 
     def init_ui(self):
         self.setFixedSize(640, 720)  # 设置窗口固定值(w, h)
@@ -175,142 +181,20 @@ class MainWindow(QWidget):
         elif self.check(idx_i, idx_j):
                 self.move(idx_i, idx_j)
                 self.click_state = ClickState.NO_SELECTED
-                # 落子成功后, 开始转换状态
-                if self.game_state == GameState.BLACK:
-                    self.game_state = GameState.RED
-                elif self.game_state == GameState.RED:
-                    self.game_state = GameState.BLACK
         self.repaint()  # 重绘
 
     def check(self, idx_i, idx_j):
         '''
-        判断目标位置是否合法
+        判断目标位置是否合法, 直接查规则服务缓存的本回合合法走法
         :param idx_i: 目标位置的row
         :param idx_j: 目标位置的col
         :return:
         '''
         old_idx_i, old_idx_j = self.old_point
-        old_c, c = self.chess[old_idx_i][old_idx_j], self.chess[idx_i][idx_j]
-        # 1. 如果目标位置是己方棋子则无效
-        if self.same(old_c, c):
-            print('目标位置是己方棋子, 下棋无效')
+        side = 1 if self.game_state == GameState.RED else 0
+        if not self.rules.is_legal(self.chess, side, old_idx_i, old_idx_j, idx_i, idx_j):
+            print('走法不合法')
             return False
-        # 2. 是否是己方落子
-        if self.game_state == GameState.RED and 1 <= old_c <= 7:
-            print('轮到红方落子')
-            return False
-        if self.game_state == GameState.BLACK and 8 <= old_c <= 14:
-            print('轮到黑方落子')
-            return False
-        # 3. 判断棋子的走法是否符合规则
-        width, height = abs(idx_j - old_idx_j), abs(idx_i - old_idx_i)
-        if old_c == Chessman.B_KING or old_c == Chessman.R_KING:  # 帅
-            # 是否是一条直线杀对方的将军
-            if width == 0 and height > 2:
-                for i in range(min(idx_i, old_idx_i)+1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        return False
-                return old_c + c == 9  # 目的地是对方将领
-            # 只能移动一个位置, 上下左右
-            if width + height != 1:
-                return False
-            # 不能出大帐
-            if idx_j < 3 or idx_j > 5:
-                return False
-            if old_c == Chessman.B_KING:
-                if idx_i < 7:
-                    return False
-            else:
-                if idx_i > 2:
-                    return False
-        elif old_c == Chessman.B_CHR or old_c == Chessman.R_CHR:  # 车
-            # 车不能拐弯
-            if width > 0 and height > 0:
-                return False
-            # 中间不能有其他棋子
-            if width > 0:  # 横着走
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if self.chess[idx_i][i] != Chessman.NOCHESS:
-                        return False
-            else:  # 竖着走
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        return False
-            return True  # 不能拐弯
-        elif old_c == Chessman.B_HORSE or old_c == Chessman.R_HORSE:  # 马
-            if width == 2 and height == 1:
-                mid = (old_idx_j + idx_j) // 2
-                if self.chess[old_idx_i][mid] != Chessman.NOCHESS:
-                    return False
-            elif width == 1 and height == 2:
-                mid = (old_idx_i + idx_i) // 2
-                if self.chess[mid][old_idx_j] != Chessman.NOCHESS:
-                    return False
-            else:
-                return False
-        elif old_c == Chessman.B_CANNON or old_c == Chessman.R_CANNON:  # 炮
-            # 炮也不能拐弯
-            if width > 0 and height > 0:
-                return False
-            # 炮要吃子的话, 必须中间有炮架
-            if width > 0:  # 横着走
-                cnt = 0  # 计算中间有多少个棋子
-                for i in range(min(idx_j, old_idx_j) + 1, max(idx_j, old_idx_j)):
-                    if self.chess[idx_i][i] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS :
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
-            else:  # 竖着走
-                cnt = 0
-                for i in range(min(idx_i, old_idx_i) + 1, max(idx_i, old_idx_i)):
-                    if self.chess[i][old_idx_j] != Chessman.NOCHESS:
-                        cnt += 1
-                if cnt == 0 and c == Chessman.NOCHESS :
-                    return True
-                elif cnt == 1 and c != Chessman.NOCHESS and not self.same(old_c, c):
-                    return True
-                return False
-        elif old_c == Chessman.B_BISHOP or old_c == Chessman.R_BISHOP:  # 仕
-            # 只能走斜线
-            if not (width == 1 and height == 1):
-                return False
-            # 跟将军一样只能在九宫格内
-            if idx_j < 3 or idx_j > 5:
-                return False
-            if old_c == Chessman.B_BISHOP:  # 黑仕
-                if idx_i < 7:
-                    return False
-            else:  # 红仕
-                if idx_i > 2:
-                    return False
-        elif old_c == Chessman.B_ELEPHANT or old_c == Chessman.R_ELEPHANT:  # 相
-            if not (width == 2 and height == 2):
-                return False
-            mid_i, mid_j = (idx_i + old_idx_i) // 2, (idx_j + old_idx_j) // 2
-            if self.chess[mid_i][mid_j] != Chessman.NOCHESS:
-                return False
-            return True
-        elif old_c == Chessman.B_PAWN or old_c == Chessman.R_PAWN:  # 兵
-            # 兵只能走一步
-            if width + height != 1:
-                return False
-            if old_c == Chessman.B_PAWN:  # 黑兵
-                if idx_i > old_idx_i:
-                    return False
-                # 没过界只能往前
-                if old_idx_i >= 5:
-                    if width != 0:
-                        return False
-            else:  # 红兵
-                if idx_i < old_idx_i:
-                    return False
-                if old_idx_i <= 4:
-                    if width != 0:
-                        return False
-            return True
         return True
 
     def move(self, idx_i, idx_j):
@@ -323,28 +207,21 @@ class MainWindow(QWidget):
         old_i, old_j = self.old_point
         chess_man = self.chess[old_i][old_j]
         self.chess[old_i][old_j] = 0
-        c = self.chess[idx_i][idx_j]
-        if c == Chessman.B_KING:
-            print('黑将死亡')
-            self.game_state = GameState.RED_WIN
-        elif c == Chessman.R_KING:
-            print('红将死亡')
-            self.game_state = GameState.BLACK_WIN
         self.chess[idx_i][idx_j] = chess_man
-
-    def same(self, chess1, chess2):
-        '''
-        判断两个棋子是否同色
-        :param chess1:
-        :param chess2:
-        :return:
-        '''
-        return (1 <= chess1 <= 7 and 1 <= chess2 <= 7) \
-               or (8 <= chess1 <= 14 and 8 <= chess2 <= 14)
+        # 落子成功后, 开始转换状态
+        if self.game_state == GameState.BLACK:
+            self.game_state = GameState.RED
+        elif self.game_state == GameState.RED:
+            self.game_state = GameState.BLACK
+        # 棋盘变了, 下一回合重新产生合法走法; 只允许合法走法, 将帅不会被吃掉, 轮到的一方无棋可走就是被将死或者困毙
+        self.rules.invalidate()
+        side = 1 if self.game_state == GameState.RED else 0
+        if not self.rules.legal_moves(self.chess, side):
+            print('红方获胜' if side == 0 else '黑方获胜')
+            self.game_state = GameState.BLACK_WIN if side else GameState.RED_WIN
 
 
 if __name__ == '__main__':
-    import sys
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
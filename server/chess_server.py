@@ -3,12 +3,45 @@ import select
 from collections import deque
 from threading import Thread
 import json
+import os, sys
+dir_path = os.path.dirname(os.path.realpath(__file__))
+parent_dir_path = os.path.abspath(os.path.join(dir_path, os.pardir))
+sys.path.insert(0, parent_dir_path)
+from chess_play.rules import Rules
+from chess_play.core import START_FEN, board_from_fen, board_to_list
+
+# 服务端记录的棋盘, 与网络上传输的坐标一致, 红子在下方
+START_CHESS = board_to_list(board_from_fen(START_FEN)[0])
+
+
+class Game:
+    '''
+    一对客户端之间的一盘棋, 转发走法之前先用规则服务检查
+    '''
+
+    def __init__(self) -> None:
+        self.chess = [row[:] for row in START_CHESS]
+        self.side = 1  # 轮到哪一方走, 红方先走
+        self.rules = Rules()
+
+    def play(self, old_i, old_j, i, j) -> bool:
+        '''
+        检查并走一步棋
+        :return: 走法是否合法, 不合法时棋盘不变
+        '''
+        if not self.rules.is_legal(self.chess, self.side, old_i, old_j, i, j):
+            return False
+        self.chess[i][j] = self.chess[old_i][old_j]
+        self.chess[old_i][old_j] = 0
+        self.side ^= 1
+        self.rules.invalidate()
+        return True
 
 
 class ChessServer:
 
     def __init__(self) -> None:
-        pass
+        self.games = {}  # 每一对客户端的棋局, 键为双方id组成的frozenset
 
     def start(self):
         server = socket.socket()
@@ -46,6 +79,18 @@ class ChessServer:
                             from_id = socket_map[socket_item]
                             obj['id'] = from_id
                             target = id_map[target_id]
+                            if 'old_point_i' in obj:  # 走棋数据, 检查走法是否合法
+                                key = frozenset((from_id, target_id))
+                                if key not in self.games:
+                                    self.games[key] = Game()
+                                if not self.games[key].play(obj['old_point_i'], obj['old_point_j'],
+                                                            obj['point_i'], obj['point_j']):
+                                    print('client [{}] 走法不合法, 不转发'.format(from_id))
+                                    # 告诉走棋的一方这步棋被拒绝, 让它悔掉这一步, 否则双方棋盘就不一致了
+                                    obj['target'] = from_id
+                                    obj['reject'] = True
+                                    socket_item.sendall(json.dumps(json.dumps(obj)).encode("utf-8"))
+                                    continue
                             # 转发数据
                             target.sendall(json.dumps(data).encode("utf-8"))
                         else:  # 客户端断开连接